@@ -1,18 +1,29 @@
+import logging
 import os
 import pathlib
 
 import repositories
 
 
+# The maximum number of results to cache, across sessions
+MAX_CACHE_ENTRIES = 1_000
+
+
 def main(repository):  # pragma: no cover
     # This is tested by tests.app.test_app.test_app, but coverage doesn't seem to
-    # realise.
+    # realise. AppTest runs this function's source without the module's imports, so we
+    # import what we need here.
+    import os
+
     import altair
     import streamlit
 
+    import repositories
+
     with streamlit.sidebar:
-        earliest_event_date = repository.get_earliest_login_event_date()
-        latest_event_date = repository.get_latest_login_event_date()
+        earliest_event_date, latest_event_date = (
+            repository.get_login_event_date_bounds()
+        )
 
         initial_from = latest_event_date.replace(month=1, day=1)
         from_ = streamlit.date_input(
@@ -41,12 +52,14 @@ def main(repository):  # pragma: no cover
 
     streamlit.header("OpenCodelists")
 
+    metrics = repository.get_opencodelists_metrics(from_, to_)
+
     lhs_column, rhs_column = streamlit.columns(2)
 
     with lhs_column:
         streamlit.metric(
             "Number of users logged in",
-            "{:,}".format(repository.get_num_users_logged_in(from_, to_)),
+            "{:,}".format(metrics.num_users_logged_in),
             border=True,
             help="The number of users logged in "
             + f"from {from_:%Y/%m/%d} to {to_:%Y/%m/%d}",
@@ -55,7 +68,7 @@ def main(repository):  # pragma: no cover
     with rhs_column:
         streamlit.metric(
             "Number of codelists created",
-            "{:,}".format(repository.get_num_codelists_created(from_, to_)),
+            "{:,}".format(metrics.num_codelists_created),
             border=True,
             help="The number of codelists created "
             + f"from {from_:%Y/%m/%d} to {to_:%Y/%m/%d}",
@@ -83,19 +96,16 @@ def main(repository):  # pragma: no cover
         )
         return layer_chart
 
-    streamlit.write(timeseries(repository.get_login_events_per_day(from_, to_)))
+    streamlit.write(timeseries(metrics.login_events_per_day))
 
     with streamlit.expander("About login events"):
         streamlit.markdown(
-            f"""
-            Currently, each of the
-            {repository.get_num_users_logged_in(from_, to_):,}
-            users is associated with a single login event:
-            the latest (most recent) login event,
-            at the time the data were extracted on {to_:%Y/%m/%d}.
-            For a given user, the time of the latest login event will change
-            from one extract to another,
-            if they login after the first extract and before the second extract.
+            """
+            OpenCodelists records the latest (most recent) login event for each user.
+            Each time the data are extracted, we add the latest login events
+            that have changed since the previous extract to a history.
+            A user who logs in more than once between two extracts
+            is associated with only the last of these login events.
             """
         )
 
@@ -104,7 +114,7 @@ def main(repository):  # pragma: no cover
         + "compared to the 28 day rolling mean in red"
     )
 
-    streamlit.write(timeseries(repository.get_num_users_logged_in_per_day(from_, to_)))
+    streamlit.write(timeseries(metrics.num_users_logged_in_per_day))
 
     streamlit.subheader("Codelist create events")
 
@@ -113,14 +123,34 @@ def main(repository):  # pragma: no cover
         + "compared to the 28 day rolling mean in red"
     )
 
-    streamlit.write(
-        timeseries(repository.get_codelist_create_events_per_day(from_, to_))
-    )
+    streamlit.write(timeseries(metrics.codelist_create_events_per_day))
+
+    if os.environ.get(repositories.PROFILE_ENV_VAR):
+        with streamlit.expander("Query profiles"):
+            for profile in reversed(repositories.PROFILES):
+                streamlit.markdown(
+                    f"`{repositories.format_call(profile)}` "
+                    + f"took {profile.wall_time:.3f}s "
+                    + f"and scanned {profile.rows_scanned:,} rows"
+                )
+                for plan in profile.plans:
+                    streamlit.code(plan, language=None)
 
 
 if __name__ == "__main__":
+    import streamlit
+
+    if os.environ.get(repositories.PROFILE_ENV_VAR):
+        logging.basicConfig(level=logging.INFO)
+
     root_uri = os.environ.get(
         "REPOSITORY_ROOT_URI", pathlib.Path("data").resolve().as_uri()
     )
-    repository = repositories.Repository(root_uri)
+    # Streamlit reruns this script on each interaction, so we share a repository (and the
+    # tables it has loaded) between reruns and sessions.
+    repository = streamlit.cache_resource(repositories.Repository)(root_uri)
+    # We also share results between reruns and sessions, until a source changes.
+    repository = repositories.CachedRepository(
+        repository, streamlit.cache_data(max_entries=MAX_CACHE_ENTRIES)
+    )
     main(repository)
@@ -3,7 +3,8 @@ import pathlib
 
 import duckdb
 import pandas
-from duckdb import sqltypes
+
+import repositories
 
 
 def main(repository):  # pragma: no cover  # called in subprocess in tests
@@ -32,20 +33,19 @@ class Repository:
     def __init__(self, uri):
         self._uri = uri
 
+    @repositories.profiled
     def get_prs_created_per_day(self):
-        with duckdb.connect() as conn:
-            rel = conn.read_csv(self._uri)
-            created_at = duckdb.ColumnExpression("created_at")
-            created_on = created_at.cast(sqltypes.DATE).alias("created_on")
-            rel = rel.select(created_on)
-            rel = rel.order("created_on")
-            rel = rel.aggregate(
-                [
-                    duckdb.ColumnExpression("created_on").alias("date"),
-                    duckdb.FunctionExpression("count").alias("count"),
-                ],  # type: ignore
-                "created_on",
+        with (
+            duckdb.connect() as conn,
+            repositories.profile_queries(conn) as conn,
+        ):
+            rel = repositories.read(conn, self._uri)
+            rel = rel.filter(duckdb.ColumnExpression("num_created") > 0)
+            rel = rel.select(
+                duckdb.ColumnExpression("date"),
+                duckdb.ColumnExpression("num_created").alias("count"),
             )
+            rel = rel.order("date")
             created_per_day = rel.to_df()
 
         # interpolate counts of zero for days without events
@@ -64,5 +64,5 @@ if __name__ == "__main__":
     root_uri = os.environ.get(
         "REPOSITORY_ROOT_URI", pathlib.Path("data").resolve().as_uri()
     )
-    repository = Repository(root_uri + "/github/opensafely-core/prs.csv")
+    repository = Repository(root_uri + "/github/opensafely-core/prs_per_day.parquet")
     main(repository)
@@ -1,130 +1,442 @@
+import collections
+import contextlib
+import contextvars
+import datetime
+import functools
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from urllib.parse import urlparse
+
 import duckdb
-import pandas
-from duckdb import sqltypes
+
+
+# Set this environment variable to profile each call to a repository's methods (see
+# `profiled`)
+PROFILE_ENV_VAR = "REPOSITORY_PROFILE"
+
+# The most recent profiles
+PROFILES = collections.deque(maxlen=100)
+
+Profile = collections.namedtuple(
+    "Profile", ["method", "args", "kwargs", "wall_time", "rows_scanned", "plans"]
+)
+
+# The metrics that DuckDB records for each query: those shown by `EXPLAIN ANALYZE`,
+# and the rows scanned by each operator
+PROFILING_SETTINGS = {
+    metric: "true"
+    for metric in [
+        "QUERY_NAME",
+        "LATENCY",
+        "EXTRA_INFO",
+        "OPERATOR_NAME",
+        "OPERATOR_TYPE",
+        "OPERATOR_TIMING",
+        "OPERATOR_CARDINALITY",
+        "OPERATOR_ROWS_SCANNED",
+    ]
+}
+
+# The profiles of the queries run by the profiled method that is running
+_queries = contextvars.ContextVar("queries")
+
+logger = logging.getLogger(__name__)
+
+# The days on which each user logged in from `from_` to `to_`.
+# This is a temporary table, so that the queries that read it scan the login events
+# once, and so that it is dropped when the cursor that created it is closed. The login
+# events are partitioned by month, and filtering on the partition column means that
+# only the partitions that overlap the days are read.
+LOGINS_QUERY = """
+CREATE OR REPLACE TEMP TABLE logins AS
+SELECT DISTINCT user_id, CAST(logged_in_at AS DATE) AS logged_in_on
+FROM read_parquet($uri, hive_partitioning = true, hive_types = {'month': 'VARCHAR'})
+WHERE month BETWEEN $from_month AND $to_month
+    AND CAST(logged_in_at AS DATE) BETWEEN $from_ AND $to_
+"""
+
+NUM_USERS_LOGGED_IN_QUERY = """
+SELECT count(DISTINCT user_id) FROM logins WHERE logged_in_on >= $from_
+"""
+
+# Rather than expanding each login event into a row for each day in the window, we
+# treat each login event as an interval of days. We merge each user's overlapping
+# intervals, so that each user is counted once per day, and then count the users
+# logged in on each day with a difference array: +1 on the first day of an interval,
+# -1 on the day after the last day, and a running sum.
+NUM_USERS_LOGGED_IN_PER_DAY_QUERY = """
+WITH intervals AS (
+    SELECT
+        user_id,
+        logged_in_on AS start_on,
+        logged_in_on + $window AS end_on,
+        lag(logged_in_on + $window) OVER (
+            PARTITION BY user_id ORDER BY logged_in_on
+        ) AS previous_end_on
+    FROM logins
+),
+islands AS (
+    SELECT
+        *,
+        count(*) FILTER (previous_end_on IS NULL OR start_on > previous_end_on) OVER (
+            PARTITION BY user_id ORDER BY start_on
+        ) AS island
+    FROM intervals
+),
+merged_intervals AS (
+    SELECT
+        greatest(min(start_on), $from_) AS start_on,
+        least(max(end_on), $to_) AS end_on
+    FROM islands
+    GROUP BY user_id, island
+),
+deltas AS (
+    SELECT start_on AS date, sum(1) AS delta FROM merged_intervals GROUP BY date
+    UNION ALL
+    SELECT end_on + 1 AS date, sum(-1) AS delta FROM merged_intervals GROUP BY date
+),
+days AS (
+    SELECT CAST(range AS DATE) AS date
+    FROM range(CAST($from_ AS TIMESTAMP), CAST($to_ AS TIMESTAMP) + INTERVAL 1 DAY, INTERVAL 1 DAY)
+),
+counts AS (
+    SELECT
+        days.date,
+        CAST(sum(coalesce(sum(deltas.delta), 0)) OVER (ORDER BY days.date) AS BIGINT) AS count
+    FROM days
+    LEFT JOIN deltas ON deltas.date = days.date
+    GROUP BY days.date
+)
+SELECT date, count
+FROM counts
+WHERE date BETWEEN (SELECT min(date) FROM counts WHERE count > 0)
+    AND (SELECT max(date) FROM counts WHERE count > 0)
+ORDER BY date
+"""
+
+# The number of login events and codelist create events on each day from `from_` to
+# `to_`, including days without events, in a single pass over each daily rollup.
+EVENTS_PER_DAY_QUERY = """
+WITH days AS (
+    SELECT CAST(range AS DATE) AS date
+    FROM range(CAST($from_ AS TIMESTAMP), CAST($to_ AS TIMESTAMP) + INTERVAL 1 DAY, INTERVAL 1 DAY)
+)
+SELECT
+    CAST(days.date AS TIMESTAMP) AS date,
+    coalesce(login_events_per_day.count, 0) AS login_events,
+    coalesce(codelist_create_events_per_day.count, 0) AS codelist_create_events
+FROM days
+LEFT JOIN login_events_per_day ON login_events_per_day.date = days.date
+LEFT JOIN codelist_create_events_per_day
+    ON codelist_create_events_per_day.date = days.date
+ORDER BY days.date
+"""
+
+OpenCodelistsMetrics = collections.namedtuple(
+    "OpenCodelistsMetrics",
+    [
+        "num_users_logged_in",
+        "num_codelists_created",
+        "login_events_per_day",
+        "num_users_logged_in_per_day",
+        "codelist_create_events_per_day",
+    ],
+)
+
+
+def profiled(method):
+    """Profile calls to a repository's `method`, if `PROFILE_ENV_VAR` is set.
+
+    A profile records the call's wall time, and the rows scanned and the plan (as given
+    by `EXPLAIN ANALYZE`) of each query run with `profile_queries`. Profiles are logged
+    and kept in `PROFILES`.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not os.environ.get(PROFILE_ENV_VAR):
+            return method(self, *args, **kwargs)
+
+        queries = []
+        token = _queries.set(queries)
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            wall_time = time.perf_counter() - start
+            _queries.reset(token)
+            profile = Profile(
+                method=method.__qualname__,
+                args=args,
+                kwargs=kwargs,
+                wall_time=wall_time,
+                rows_scanned=sum(_get_rows_scanned(query) for query in queries),
+                plans=[query["plan"] for query in queries],
+            )
+            PROFILES.append(profile)
+            logger.info(
+                "%s took %.3fs and scanned %s rows\n%s",
+                format_call(profile),
+                profile.wall_time,
+                profile.rows_scanned,
+                "\n".join(profile.plans),
+            )
+
+    return wrapper
+
+
+def format_call(profile):
+    """Return the call that `profile` profiled, as it would be written."""
+    args = [repr(arg) for arg in profile.args]
+    args += [f"{name}={value!r}" for name, value in profile.kwargs.items()]
+    return f"{profile.method}({', '.join(args)})"
+
+
+@contextlib.contextmanager
+def profile_queries(conn):
+    """Profile the queries run on `conn`, if it is used by a profiled method.
+
+    Yields `conn` or, if it is used by a profiled method, a proxy for `conn`.
+    """
+    queries = _queries.get(None)
+    if queries is None:
+        yield conn
+        return
+
+    conn.execute("SET enable_profiling = 'no_output'")
+    conn.execute("SET custom_profiling_settings = ?", [json.dumps(PROFILING_SETTINGS)])
+    profiling_conn = _ProfilingConnection(conn, queries)
+    yield profiling_conn
+    profiling_conn.record()
+
+
+def _get_rows_scanned(node):
+    # A query's total isn't set when its result is fetched lazily, as with relations,
+    # so we sum the rows scanned by each operator in the query's plan
+    return node.get("operator_rows_scanned", 0) + sum(
+        _get_rows_scanned(child) for child in node.get("children", [])
+    )
+
+
+class _ProfilingConnection:
+    # DuckDB keeps the profile of the last query run on a connection, which is complete
+    # when the query's result has been fetched. We record it whenever the connection is
+    # used, and when it is no longer used, so that we also record the queries run by
+    # relations. A profile that we have already recorded (or that of enabling
+    # profiling) is skipped.
+
+    def __init__(self, conn, queries):
+        self._conn = conn
+        self._queries = queries
+        self._last_profile = conn.get_profiling_information(format="json")
+
+    def __getattr__(self, name):
+        self.record()
+        return getattr(self._conn, name)
+
+    def record(self):
+        profile = self._conn.get_profiling_information(format="json")
+        if profile == self._last_profile:
+            return
+        self._last_profile = profile
+        query = json.loads(profile)
+        query["plan"] = self._conn.get_profiling_information(format="query_tree")
+        self._queries.append(query)
 
 
 class Repository:
     def __init__(self, root_uri):
         self.uris = {
-            "login_events": root_uri + "/opencodelists/login_events.csv",
-            "codelist_create_events": root_uri
-            + "/opencodelists/codelist_create_events.csv",
+            "login_events": root_uri
+            + "/opencodelists/login_events.parquet/*/*.parquet",
+            "login_events_per_day": root_uri
+            + "/opencodelists/login_events_per_day.parquet",
+            "codelist_create_events_per_day": root_uri
+            + "/opencodelists/codelist_create_events_per_day.parquet",
         }
+        # A repository is shared between Streamlit sessions, which run in different
+        # threads. Each query uses its own cursor (a connection to the same in-memory
+        # database), and the lock guards loading sources into tables. Login events are
+        # partitioned, and are read from the partitions rather than loaded.
+        self._conn = duckdb.connect()
+        self._lock = threading.Lock()
+        self._versions = {}
 
-    def get_earliest_login_event_date(self):  # pragma: no cover
-        return _get_scalar_result(
-            self.uris["login_events"], "min", "logged_in_at"
-        ).date()
-
-    def get_latest_login_event_date(self):  # pragma: no cover
-        return _get_scalar_result(
-            self.uris["login_events"], "max", "logged_in_at"
-        ).date()
+    @profiled
+    def get_login_event_date_bounds(self):
+        """Return the dates of the earliest and the latest login events."""
+        with self._cursor() as conn:
+            rel = self._table(conn, "login_events_per_day")
+            return rel.aggregate("min(date), max(date)").fetchone()
 
-    def get_login_events_per_day(self, from_, to_):  # pragma: no cover
-        return _get_events_per_day(
-            self.uris["login_events"], "logged_in_at", from_, to_
-        )
+    @profiled
+    def get_opencodelists_metrics(self, from_, to_, window=14):
+        """Return the metrics for the OpenCodelists page from `from_` to `to_`.
 
-    def get_num_users_logged_in_per_day(self, from_, to_):
+        Each source is scanned once. See `get_num_users_logged_in_per_day` for
+        `window`.
+        """
         assert from_ <= to_
-        with duckdb.connect() as conn:
-            rel = conn.read_csv(self.uris["login_events"])
-            rel = rel.select(
-                "email_hash, logged_in_at, logged_in_at + INTERVAL 14 DAYS AS logged_out_at"
-            )
-            rel = rel.select(
-                "email_hash, CAST(logged_in_at AS DATE) AS logged_in_on, CAST(logged_out_at AS DATE) AS logged_out_on"
-            )
-            rel = rel.select(
-                "email_hash, generate_series(logged_in_on, logged_out_on, INTERVAL 1 DAY) AS logged_in_on"
-            )
-            rel = rel.select("email_hash, unnest(logged_in_on) AS logged_in_on")
-            rel = rel.filter(duckdb.ColumnExpression("logged_in_on") >= from_)
-            rel = rel.filter(duckdb.ColumnExpression("logged_in_on") <= to_)
-            rel = rel.distinct()
-            rel = rel.aggregate(
-                [
-                    duckdb.ColumnExpression("logged_in_on").alias("date"),
-                    duckdb.FunctionExpression("count").alias("count"),
-                ],
-                "logged_in_on",
-            )
+        with self._cursor() as conn:
+            self._table(conn, "login_events_per_day")
+            self._table(conn, "codelist_create_events_per_day")
 
-            num_users_logged_in_per_day = rel.to_df()
+            self._load_logins(conn, from_, to_, window)
+            num_users_logged_in, *_ = conn.execute(
+                NUM_USERS_LOGGED_IN_QUERY, {"from_": from_}
+            ).fetchone()
+            num_users_logged_in_per_day = conn.execute(
+                NUM_USERS_LOGGED_IN_PER_DAY_QUERY,
+                {"from_": from_, "to_": to_, "window": window},
+            ).df()
 
-        # interpolate counts of zero for days without logged in users
-        idx = pandas.date_range(
-            num_users_logged_in_per_day["date"].min(),
-            num_users_logged_in_per_day["date"].max(),
-            freq="D",
-            normalize=True,
-            name="date",
-        )
-        return (
-            num_users_logged_in_per_day.set_index("date")
-            .reindex(idx)
-            .fillna(0)
-            .reset_index()
+            events_per_day = conn.execute(
+                EVENTS_PER_DAY_QUERY, {"from_": from_, "to_": to_}
+            ).df()
+
+        return OpenCodelistsMetrics(
+            num_users_logged_in=num_users_logged_in,
+            num_codelists_created=int(events_per_day["codelist_create_events"].sum()),
+            login_events_per_day=events_per_day[["date", "login_events"]].rename(
+                columns={"login_events": "count"}
+            ),
+            num_users_logged_in_per_day=num_users_logged_in_per_day,
+            codelist_create_events_per_day=events_per_day[
+                ["date", "codelist_create_events"]
+            ].rename(columns={"codelist_create_events": "count"}),
         )
 
+    @profiled
+    def get_num_users_logged_in_per_day(self, from_, to_, window=14):
+        """Return the number of users logged in on each day.
+
+        A user is logged in on the day of a login event and on each of the following
+        `window` days. The days run from the first to the last day, from `from_` to
+        `to_`, with at least one user logged in.
+        """
+        assert from_ <= to_
+        with self._cursor() as conn:
+            self._load_logins(conn, from_, to_, window)
+            return conn.execute(
+                NUM_USERS_LOGGED_IN_PER_DAY_QUERY,
+                {"from_": from_, "to_": to_, "window": window},
+            ).df()
+
+    @profiled
     def get_num_users_logged_in(self, from_, to_):
         assert from_ <= to_
-        with duckdb.connect() as conn:
-            rel = conn.read_csv(self.uris["login_events"])
-            logged_in_at = duckdb.ColumnExpression("logged_in_at")
-            login_on = logged_in_at.cast(sqltypes.DATE).alias("login_on")
-            rel = rel.filter(login_on >= from_)
-            rel = rel.filter(login_on <= to_)
-            rel = rel.select("email_hash").distinct().count("email_hash")
-            val, *_ = rel.fetchone()
+        with self._cursor() as conn:
+            self._load_logins(conn, from_, to_, 0)
+            val, *_ = conn.execute(
+                NUM_USERS_LOGGED_IN_QUERY, {"from_": from_}
+            ).fetchone()
         return val
 
-    def get_codelist_create_events_per_day(self, from_, to_):  # pragma: no cover
-        return _get_events_per_day(
-            self.uris["codelist_create_events"], "created_at", from_, to_
-        )
-
+    @profiled
     def get_num_codelists_created(self, from_, to_):
         assert from_ <= to_
-        with duckdb.connect() as conn:
-            rel = conn.read_csv(self.uris["codelist_create_events"])
-            created_at = duckdb.ColumnExpression("created_at")
-            created_on = created_at.cast(sqltypes.DATE).alias("created_on")
-            rel = rel.filter(created_on >= from_)
-            rel = rel.filter(created_on <= to_)
-            rel = rel.count("id")
+        with self._cursor() as conn:
+            rel = self._table(conn, "codelist_create_events_per_day")
+            date = duckdb.ColumnExpression("date")
+            rel = rel.filter(date >= from_)
+            rel = rel.filter(date <= to_)
+            rel = rel.aggregate("coalesce(sum(count), 0)")
             val, *_ = rel.fetchone()
         return val
 
+    def get_version(self):
+        """Return the version of the sources, which changes when any source changes.
+
+        A source's version is its size and last modified time.
+        """
+        with self._conn.cursor() as conn:
+            return tuple(
+                conn.execute(
+                    "SELECT filename, size, epoch_ms(last_modified) "
+                    + "FROM read_blob(?) ORDER BY filename",
+                    [list(self.uris.values())],
+                ).fetchall()
+            )
+
+    @contextlib.contextmanager
+    def _cursor(self):
+        with self._conn.cursor() as conn, profile_queries(conn) as conn:
+            yield conn
 
-def _get_scalar_result(uri, func, col):
-    with duckdb.connect() as conn:
-        rel = conn.read_csv(uri)
-        val, *_ = getattr(rel, func)(col).fetchone()
-    return val
-
-
-def _get_events_per_day(uri, col, from_, to_):
-    assert from_ <= to_
-    with duckdb.connect() as conn:
-        rel = conn.read_csv(uri)
-        event_at = duckdb.ColumnExpression(col)
-        event_on = event_at.cast(sqltypes.DATE).alias("event_on")
-        rel = rel.filter(event_on >= from_)
-        rel = rel.filter(event_on <= to_)
-        rel = rel.select(event_on)
-        rel = rel.order("event_on")
-        rel = rel.aggregate(
-            [
-                duckdb.ColumnExpression("event_on").alias("date"),
-                duckdb.FunctionExpression("count").alias("count"),
-            ],
-            "event_on",
+    def _load_logins(self, conn, from_, to_, window):
+        # A user logged in `window` days before `from_` is logged in on `from_`
+        from_ = from_ - datetime.timedelta(days=window)
+        conn.execute(
+            LOGINS_QUERY,
+            {
+                "uri": self.uris["login_events"],
+                "from_month": f"{from_:%Y-%m}",
+                "to_month": f"{to_:%Y-%m}",
+                "from_": from_,
+                "to_": to_,
+            },
         )
 
-        events_per_day = rel.to_df()
+    def _table(self, conn, name):
+        """Return a relation for the table loaded from the source called `name`.
+
+        A source is loaded into a table when it is first queried, and is reloaded only
+        when its size or last modified time changes, so that queries needn't parse it.
+        """
+        uri = self.uris[name]
+        with self._lock:
+            version = conn.execute(
+                "SELECT size, epoch_ms(last_modified) FROM read_blob(?)", [uri]
+            ).fetchall()
+            if self._versions.get(name) != version:
+                read(conn, uri).query(
+                    "source", f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM source"
+                )
+                self._versions[name] = version
+        return conn.table(name)
+
+
+class CachedRepository:
+    """Cache the results of a repository's methods.
+
+    Results are keyed by the method's name, by its arguments, and by the version of
+    the repository's sources, so that they are recomputed when a source changes.
+    `cache` is a decorator, such as `streamlit.cache_data`, that determines where
+    results are stored, whether they are shared, and how many are kept.
+    """
+
+    def __init__(self, repository, cache):
+        self._repository = repository
+        self._call = cache(_call)
+
+    def __getattr__(self, name):
+        method = getattr(self._repository, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            version = self._repository.get_version()
+            return self._call(self._repository, name, version, *args, **kwargs)
+
+        return wrapper
+
+
+def _call(_repository, name, version, *args, **kwargs):
+    # The leading underscore tells Streamlit not to hash the repository.
+    return getattr(_repository, name)(*args, **kwargs)
+
 
-    # interpolate counts of zero for days without events
-    idx = pandas.date_range(from_, to_, freq="D", normalize=True, name="date")
-    return events_per_day.set_index("date").reindex(idx).fillna(0).reset_index()
+def read(conn, uri):
+    """Read the CSV or Parquet file at `uri` into a relation, dispatching on its suffix."""
+    match pathlib.PurePosixPath(urlparse(uri).path).suffix:
+        case ".csv":
+            return conn.read_csv(uri)
+        case ".parquet":
+            return conn.read_parquet(uri)
+        case suffix:
+            raise ValueError(f"Unsupported file type {suffix}")
@@ -0,0 +1,175 @@
+import argparse
+import json
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+import repositories
+from pages import delivery_metrics
+from tasks.tasks import get_github_data
+
+from . import data
+
+
+# The times saved with `--save`. Times depend on the machine, so the baseline isn't
+# committed.
+BASELINE_PATH = pathlib.Path(__file__).with_name("baseline.json")
+
+# The maximum number of times each benchmark is timed. We report the fastest time,
+# which is the least affected by other work on the machine.
+REPEAT = 5
+
+# The time, in seconds, after which we stop repeating a benchmark
+MAX_DURATION = 10
+
+# The sizes of the datasets to benchmark, if none are given. The repositories load each
+# dataset into an in-memory table on every cold call, which, for the largest datasets,
+# takes more time and memory than most machines have to spare.
+DEFAULT_SIZES = ["10k", "1m"]
+
+# The number of PRs in the page that the GitHub API returns to `get_prs`
+PAGE_SIZE = 100
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "sizes",
+        nargs="*",
+        choices=list(data.SIZES),
+        help=f"the sizes of the datasets to benchmark (default: {' '.join(DEFAULT_SIZES)})",
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="save the results as the baseline for the sizes",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="the fraction by which a time can exceed its baseline (default: 0.5)",
+    )
+    args = parser.parse_args()
+
+    if BASELINE_PATH.exists():
+        baseline = json.loads(BASELINE_PATH.read_text())
+    else:
+        print(f"There is no baseline at {BASELINE_PATH}; save one with --save")
+        baseline = {}
+    num_regressions = 0
+    for size in args.sizes or DEFAULT_SIZES:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = run(pathlib.Path(tmp_dir), data.SIZES[size])
+        num_regressions += report(size, results, baseline.get(size, {}), args.tolerance)
+        baseline[size] = results
+
+    if args.save:
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+    sys.exit(1 if num_regressions and not args.save else 0)
+
+
+def run(directory, num_rows):
+    """Generate datasets of `num_rows` rows in `directory` and time each benchmark."""
+    start = time.perf_counter()
+    data.generate(directory, num_rows)
+    print(f"Generated {num_rows:,} rows in {time.perf_counter() - start:.1f}s")
+
+    root_uri = directory.resolve().as_uri()
+    from_ = data.END.date().replace(month=1, day=1)
+    to_ = data.END.date()
+    calls = {
+        "get_login_event_date_bounds": (),
+        "get_opencodelists_metrics": (from_, to_),
+        "get_num_users_logged_in_per_day": (from_, to_),
+        "get_num_users_logged_in": (from_, to_),
+        "get_num_codelists_created": (from_, to_),
+    }
+
+    results = {}
+    for name, args in calls.items():
+        # A cold call loads the tables that the method queries; a warm call reuses them
+        results[f"Repository.{name} (cold)"] = time_calls(
+            lambda: getattr(repositories.Repository(root_uri), name)(*args)
+        )
+        repository = repositories.Repository(root_uri)
+        getattr(repository, name)(*args)
+        results[f"Repository.{name} (warm)"] = time_calls(
+            lambda: getattr(repository, name)(*args)
+        )
+
+    prs_per_day_uri = f"{root_uri}/github/{data.ORG}/prs_per_day.parquet"
+    results["delivery_metrics.Repository.get_prs_created_per_day"] = time_calls(
+        lambda: delivery_metrics.Repository(prs_per_day_uri).get_prs_created_per_day()
+    )
+
+    # `get_prs` updates the store, so each call gets a fresh copy of it
+    org_dir = directory / "github" / data.ORG
+    nodes = data.get_pr_nodes(org_dir, PAGE_SIZE)
+    work_dir = directory / "get_prs"
+
+    def setup():
+        shutil.rmtree(work_dir, ignore_errors=True)
+        work_dir.mkdir()
+        shutil.copy(org_dir / "prs.duckdb", work_dir / "prs.duckdb")
+
+    results["get_github_data.get_prs"] = time_calls(
+        lambda: get_github_data.get_prs(
+            FakeClient(nodes), data.ORG, work_dir / "prs.duckdb"
+        ),
+        setup,
+    )
+    return results
+
+
+def time_calls(func, setup=lambda: None):
+    """Return the fastest of up to `REPEAT` timed calls to `func`, in seconds.
+
+    `setup` is called, untimed, before each call. We stop repeating when the calls have
+    taken `MAX_DURATION` seconds, so that slow benchmarks are timed once.
+    """
+    durations = []
+    while len(durations) < REPEAT and sum(durations) < MAX_DURATION:
+        setup()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return round(min(durations), 4)
+
+
+def report(size, results, baseline, tolerance):
+    """Print `results` alongside `baseline`, and return the number of regressions."""
+    num_regressions = 0
+    print(f"\n{size}")
+    for name, duration in results.items():
+        line = f"  {name:<60} {duration:8.3f}s"
+        if name in baseline:
+            ratio = duration / baseline[name]
+            line += f"  {ratio:5.2f}x baseline"
+            if ratio > 1 + tolerance:
+                line += "  REGRESSION"
+                num_regressions += 1
+        print(line)
+    return num_regressions
+
+
+class FakeClient:
+    """Return a page of `nodes`, then their last node, which `get_prs` has seen.
+
+    This is the shortest drain loop: one page of changes and one page without.
+    """
+
+    def __init__(self, nodes):
+        self._pages = [nodes, nodes[-1:]]
+
+    def query(self, org, query):
+        return self._pages.pop(0) if self._pages else []
+
+    def count(self, org, query):
+        return len(self._pages)
+
+
+if __name__ == "__main__":
+    main()
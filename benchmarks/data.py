@@ -0,0 +1,172 @@
+import datetime
+
+import duckdb
+
+from tasks import io
+from tasks.tasks import get_github_data, get_github_rollups, get_opencodelists_rollups
+
+
+# The names of the sizes of the generated datasets, and their numbers of rows
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+# The generated events span the three years before this time
+END = datetime.datetime(2025, 6, 30, 23, 59, 59)
+START = END.replace(year=END.year - 3)
+SPAN = int((END - START).total_seconds())
+
+# The org of the generated PRs
+ORG = "opensafely-core"
+
+# The number of repositories that the generated PRs are spread across
+NUM_REPOSITORIES = 50
+
+# Each user logs in this many times, on average
+LOGINS_PER_USER = 10
+
+
+def generate(directory, num_rows):
+    """Generate datasets of `num_rows` rows each in `directory`.
+
+    The datasets have the layout of `tasks.DATA_DIR`, so that `directory` can be the
+    root of a `repositories.Repository`. Values are derived from hashes of the row
+    number rather than from a random number generator, so the datasets are the same for
+    each call.
+    """
+    opencodelists_dir = directory / "opencodelists"
+    opencodelists_dir.mkdir(parents=True, exist_ok=True)
+    org_dir = directory / "github" / ORG
+    org_dir.mkdir(parents=True, exist_ok=True)
+
+    with duckdb.connect() as conn:
+        _copy(
+            conn,
+            """
+            SELECT
+                $start + to_seconds(CAST(hash(range, 'logged_in_at') % $span AS BIGINT))
+                    AS logged_in_at,
+                CAST(hash(range, 'user') % $num_users + 1 AS INTEGER) AS user_id,
+            FROM range($num_rows)
+            """,
+            {"num_rows": num_rows, "num_users": max(num_rows // LOGINS_PER_USER, 1)},
+            opencodelists_dir / "login_events.parquet",
+            partition_by="logged_in_at",
+        )
+        _copy(
+            conn,
+            """
+            SELECT
+                $start + to_seconds(CAST(hash(range, 'created_at') % $span AS BIGINT))
+                    AS created_at,
+                CAST(range + 1 AS INTEGER) AS id,
+            FROM range($num_rows)
+            """,
+            {"num_rows": num_rows},
+            opencodelists_dir / "codelist_create_events.parquet",
+            partition_by="created_at",
+        )
+
+    # Most PRs are merged or closed within a few days of being created. We write the store
+    # with DuckDB rather than with `io.upsert`, but we create the same table.
+    schema = get_github_data.SCHEMA
+    columns = ", ".join(f"{name} {type_}" for name, type_ in schema.items())
+    with duckdb.connect(str(org_dir / "prs.duckdb")) as conn:
+        conn.execute(
+            f"CREATE TABLE prs ({columns}, "
+            + f"PRIMARY KEY ({', '.join(get_github_data.KEY)}))"
+        )
+        for name in get_github_data.INDEX:
+            conn.execute(f"CREATE INDEX prs_{name} ON prs ({name})")
+        conn.execute(
+            """
+            INSERT INTO prs BY NAME
+            WITH prs AS (
+                SELECT
+                    range,
+                    $start + to_seconds(CAST(hash(range, 'created_at') % $span AS BIGINT))
+                        AS created_at,
+                    created_at + to_seconds(
+                        CAST(hash(range, 'updated_at') % (7 * 24 * 60 * 60) AS BIGINT)
+                    ) AS updated_at,
+                    hash(range, 'state') % 10 AS state,
+                FROM range($num_rows)
+            )
+            SELECT
+                $org AS org,
+                'repo-' || (range % $num_repositories) AS repository,
+                CAST(range // $num_repositories + 1 AS INTEGER) AS number,
+                'author-' || (hash(range, 'author') % 100) AS author,
+                created_at,
+                updated_at,
+                CASE WHEN state < 8 THEN updated_at END AS closed_at,
+                CASE WHEN state < 6 THEN updated_at END AS merged_at,
+                state = 9 AS is_draft,
+            FROM prs
+            """,
+            {
+                "start": START,
+                "span": SPAN,
+                "num_rows": num_rows,
+                "org": ORG,
+                "num_repositories": NUM_REPOSITORIES,
+            },
+        )
+
+    io.write(
+        get_opencodelists_rollups.get_login_events_per_day(
+            opencodelists_dir / "login_events.parquet"
+        ),
+        opencodelists_dir / "login_events_per_day.parquet",
+        schema=get_opencodelists_rollups.LOGIN_EVENTS_PER_DAY_SCHEMA,
+    )
+    io.write(
+        get_opencodelists_rollups.get_codelist_create_events_per_day(
+            opencodelists_dir / "codelist_create_events.parquet"
+        ),
+        opencodelists_dir / "codelist_create_events_per_day.parquet",
+        schema=get_opencodelists_rollups.CODELIST_CREATE_EVENTS_PER_DAY_SCHEMA,
+    )
+    io.write(
+        get_github_rollups.get_prs_per_day(org_dir / "prs.duckdb"),
+        org_dir / "prs_per_day.parquet",
+        schema=get_github_rollups.SCHEMA,
+    )
+
+
+def _copy(conn, query, params, f_path, partition_by):
+    # We write with DuckDB rather than with `io.write`, which would pass each row through
+    # Python, but we write the same layout: partitions by month.
+    rel = conn.sql(query, params={"start": START, "span": SPAN, **params})
+    month = f"strftime({partition_by}, '%Y-%m') AS month"
+    rel.select(f"*, {month}").write_parquet(
+        str(f_path), compression="zstd", partition_by=["month"]
+    )
+
+
+def get_pr_nodes(org_dir, num_nodes):
+    """Return `num_nodes` PRs, as returned by the GitHub API, updated after those in
+    `org_dir`.
+
+    Half are new; half update PRs in `org_dir`.
+    """
+    with duckdb.connect(str(org_dir / "prs.duckdb"), read_only=True) as conn:
+        updated_at, max_number = conn.execute(
+            "SELECT max(updated_at), max(number) FROM prs"
+        ).fetchone()
+    nodes = []
+    for i in range(num_nodes):
+        updated_at += datetime.timedelta(seconds=1)
+        timestamp = get_github_data.to_string(updated_at)
+        nodes.append(
+            {
+                "repository": {"name": "repo-0"},
+                # Odd nodes update existing PRs; even nodes are new PRs
+                "number": i // 2 + 1 if i % 2 else max_number + i // 2 + 1,
+                "author": {"login": "author-0"},
+                "createdAt": timestamp,
+                "updatedAt": timestamp,
+                "closedAt": None,
+                "mergedAt": None,
+                "isDraft": False,
+            }
+        )
+    return nodes
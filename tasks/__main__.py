@@ -1,17 +1,25 @@
 import argparse
+import concurrent.futures
+import datetime
+import multiprocessing
+import os
 import pkgutil
 import sys
 
 import tasks.tasks
 
+from . import DATA_DIR, instrumentation, runner
+
 
 TASK_NAMES = {
     x.name for x in pkgutil.iter_modules(tasks.tasks.__path__) if x.name != "__main__"
 }
 
+# The fingerprints of each task's inputs when it last succeeded
+STATE_PATH = DATA_DIR / "tasks_state.json"
 
-def get_task_module(task_name):
-    return pkgutil.resolve_name(f"{tasks.tasks.__name__}.{task_name}")
+# The run reports (see `tasks.instrumentation`), one for each run
+REPORTS_DIR = DATA_DIR / "reports"
 
 
 def main(args):
@@ -21,17 +29,51 @@ def main(args):
             for task_name in sorted(TASK_NAMES):
                 print(task_name)
         case "run":
-            get_task_module(arg_dict["task_name"]).main()
+            run(arg_dict["task_names"], arg_dict["force"])
+        case "run-all":
+            run(sorted(TASK_NAMES), arg_dict["force"])
         case _:
             raise ValueError
 
 
+def run(task_names, force):
+    tasks_ = [runner.get_task(task_name) for task_name in task_names]
+
+    # The worker processes inherit the environment, so they append to this report
+    now = datetime.datetime.now(datetime.UTC)
+    report_path = REPORTS_DIR / f"{now:%Y%m%dT%H%M%SZ}.jsonl"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    os.environ[instrumentation.REPORT_PATH_ENV_VAR] = str(report_path)
+
+    # DuckDB (which many tasks use) starts threads, and forking a multi-threaded
+    # process isn't safe, so we spawn the processes instead. Each task has its own
+    # process, so that the peak memory use in its spans is its own.
+    mp_context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+        mp_context=mp_context, max_tasks_per_child=1
+    ) as executor:
+        statuses = runner.run(tasks_, executor, STATE_PATH, force)
+    for task_name, status in statuses.items():
+        instrumentation.record("task_status", task=task_name, status=status.value)
+        print(f"{task_name}: {status.value}")
+    print(f"Report: {report_path}")
+    if runner.Status.FAILED in statuses.values():
+        sys.exit(1)
+
+
 def parse_args(args):
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(required=True, dest="subparser_name")
     subparsers.add_parser("list")
     run_parser = subparsers.add_parser("run")
-    run_parser.add_argument("task_name", choices=TASK_NAMES)
+    run_parser.add_argument("task_names", nargs="+", choices=TASK_NAMES)
+    run_all_parser = subparsers.add_parser("run-all")
+    for subparser in [run_parser, run_all_parser]:
+        subparser.add_argument(
+            "--force",
+            action="store_true",
+            help="Run tasks even if their inputs haven't changed",
+        )
     return vars(parser.parse_args(args))
 
 
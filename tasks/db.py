@@ -1,9 +1,14 @@
 import enum
 import os
+import pathlib
 
 import sqlalchemy
 
 
+# The number of rows to fetch from a database at a time
+BATCH_SIZE = 10_000
+
+
 class Database(enum.StrEnum):
     OPENCODELISTS = enum.auto()
 
@@ -18,7 +23,34 @@ def get_engine(database):
             raise TypeError(f"Cannot get engine for database `{database}`")
 
 
-def reflect_metadata(engine):
+def get_paths(database):
+    """Return the paths to the files of `database`, or no paths if they aren't set.
+
+    Tasks that read a database declare its files as inputs (see `tasks.runner`), so that
+    they are skipped when it hasn't changed. They call this when they are imported, so
+    it doesn't raise if the environment variable isn't set.
+    """
+    match database:
+        case Database.OPENCODELISTS:
+            path = os.environ.get("OPENCODELISTS_DATABASE_PATH")
+            return [pathlib.Path(path)] if path else []
+        case _:
+            raise TypeError(f"Cannot get paths for database `{database}`")
+
+
+def reflect_metadata(engine, only=None):
+    """Reflect the tables in `only` (or, if `only` is `None`, every table)."""
     metadata = sqlalchemy.MetaData()
-    metadata.reflect(bind=engine)
+    metadata.reflect(bind=engine, only=only)
     return metadata
+
+
+def stream(engine, stmt, batch_size=BATCH_SIZE):
+    """Execute `stmt`, yielding its rows but fetching `batch_size` rows at a time.
+
+    Where the database supports it, rows are fetched with a server-side cursor, so
+    memory use doesn't grow with the number of rows.
+    """
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=batch_size)
+        yield from conn.execute(stmt)
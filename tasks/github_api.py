@@ -1,16 +1,47 @@
+import collections
+import datetime
 import json
+import threading
+import time
 
 import requests
 
+from . import instrumentation
+
+
+# The number of times to retry a failed request
+MAX_RETRIES = 5
+# The initial and the maximum delay, in seconds, when backing off exponentially
+BACKOFF = 1
+MAX_BACKOFF = 60
+# The number of seconds to wait for a response before retrying a request. Without it,
+# a connection that stalls would hang a drain loop indefinitely.
+TIMEOUT = 60
+
 
 class Client:
-    def __init__(self, tokens):
+    """A GitHub GraphQL API client that can be shared between threads.
+
+    `tokens` is a dict of tokens keyed by org. Queries for orgs that share a token share
+    that token's rate limit budget (see `RateLimiter`).
+    """
+
+    def __init__(self, tokens, rate_limiter=None):
         self._tokens = tokens
-        self._session = requests.Session()
+        self._rate_limiter = rate_limiter or RateLimiter()
+        # Sessions aren't guaranteed to be thread-safe, so each thread has its own.
+        self._local = threading.local()
+
+    @property
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
 
     def query(self, org, query):
-        more_pages = True
+        """Yield the nodes from each page of results of a search query."""
         cursor = None
+        more_pages = True
         while more_pages:
             page = self._query_page(org, query, cursor)
             yield from page["nodes"]
@@ -18,18 +49,49 @@ class Client:
             more_pages = page_info["hasNextPage"]
             cursor = page_info["endCursor"]
 
+    def count(self, org, query):
+        """Return the number of results of a search query, without fetching them."""
+        return self._query_page(org, query, None)["issueCount"]
+
     def _query_page(self, org, query, cursor):
-        response = self._session.post(
-            "https://api.github.com/graphql",
-            headers=self._get_headers(org),
-            json={"query": query, "variables": {"cursor": cursor}},
-        )
+        # Transient failures (server errors, dropped connections, and secondary rate limits)
+        # are retried after a delay (see `get_retry_delay`), so that they don't abort a long
+        # drain loop.
+        # Each page is a span in the run report, so that we can count pages and see
+        # their latencies (including retries) and costs.
+        token = self._tokens[org]
+        with instrumentation.span("github_api.query_page", org=org) as span:
+            for attempt in range(MAX_RETRIES + 1):
+                span["attempts"] = attempt + 1
+                cost = self._rate_limiter.acquire(token)
+                response = None
+                rate_limit = None
+                try:
+                    response = self._session.post(
+                        "https://api.github.com/graphql",
+                        headers=self._get_headers(org),
+                        json={"query": query, "variables": {"cursor": cursor}},
+                        timeout=TIMEOUT,
+                    )
 
-        response.raise_for_status()
-        results = response.json()
-        self._check_results(results, query)
+                    response.raise_for_status()
+                    results = response.json()
+                    rate_limit = (results.get("data") or {}).get("rateLimit")
+                    span["rate_limit"] = rate_limit
+                    if not is_rate_limited(results) or attempt == MAX_RETRIES:
+                        self._check_results(results, query)
+                        return results["data"]["search"]
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == MAX_RETRIES:
+                        raise
+                except requests.HTTPError:
+                    if not is_retryable(response) or attempt == MAX_RETRIES:
+                        raise
+                finally:
+                    self._rate_limiter.release(token, cost, rate_limit)
 
-        return results["data"]["search"]
+                headers = response.headers if response is not None else {}
+                time.sleep(get_retry_delay(headers, attempt, time.time()))
 
     def _get_headers(self, org):
         return {
@@ -54,10 +116,96 @@ Response:
             raise RuntimeError(msg)
 
 
+def is_retryable(response):
+    """Is the response to a failed request worth retrying?
+
+    GitHub indicates that a primary or secondary rate limit was exceeded with a 403 or a
+    429 response, with either a `Retry-After` header or no remaining requests.
+    """
+    if response.status_code in {500, 502, 503, 504}:
+        return True
+    if response.status_code in {403, 429}:
+        return (
+            "Retry-After" in response.headers
+            or response.headers.get("X-RateLimit-Remaining") == "0"
+        )
+    return False
+
+
+def is_rate_limited(results):
+    """Did a successful request return a GraphQL rate limit error?"""
+    return any(
+        error.get("type") == "RATE_LIMITED" for error in results.get("errors") or []
+    )
+
+
+def get_retry_delay(headers, attempt, now):
+    """Return the number of seconds to wait before retrying a failed request.
+
+    We follow GitHub's advice: wait for `Retry-After` seconds if it's present; otherwise,
+    if there are no remaining requests, then wait until `X-RateLimit-Reset` (in UTC epoch
+    seconds); otherwise, back off exponentially.
+    """
+    if "Retry-After" in headers:
+        return float(headers["Retry-After"])
+    if headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in headers:
+        return max(0, int(headers["X-RateLimit-Reset"]) - now)
+    return min(MAX_BACKOFF, BACKOFF * 2**attempt)
+
+
+class RateLimiter:
+    """Schedules queries so that they stay within each token's GraphQL rate limit.
+
+    GitHub gives each token a budget of points, which is reset hourly. Each query costs
+    points, and reports its cost, the remaining points, and when the budget will be reset
+    in a `rateLimit` object. Before a query, we reserve its estimated cost (the cost of the
+    previous query with the same token); if the remaining points, less the points reserved
+    by queries in flight, don't cover it, then we wait until the budget is reset.
+    """
+
+    def __init__(self, clock=time.time, sleep=time.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._remaining = {}
+        self._reset_at = {}
+        self._costs = collections.defaultdict(lambda: 1)
+        self._reserved = collections.Counter()
+
+    def acquire(self, token):
+        """Reserve the estimated cost of a query, waiting if necessary, and return it."""
+        while True:
+            with self._lock:
+                cost = self._costs[token]
+                now = self._clock()
+                if (
+                    token not in self._remaining
+                    or now >= self._reset_at[token]
+                    or self._remaining[token] - self._reserved[token] >= cost
+                ):
+                    self._reserved[token] += cost
+                    return cost
+                delay = self._reset_at[token] - now
+            self._sleep(delay)
+
+    def release(self, token, cost, rate_limit):
+        """Release the points reserved for a query, and update the budget from its
+        `rateLimit` object (or `None`, if the query failed)."""
+        with self._lock:
+            self._reserved[token] -= cost
+            if rate_limit is None:
+                return
+            self._costs[token] = rate_limit["cost"]
+            self._remaining[token] = rate_limit["remaining"]
+            self._reset_at[token] = datetime.datetime.fromisoformat(
+                rate_limit["resetAt"]
+            ).timestamp()
+
+
 PR_QUERY = """
 query prs($cursor: String) {
   search(
-    query: "org:%s is:pr sort:updated-asc updated:>=%s"
+    query: "org:%s is:pr sort:updated-asc updated:%s"
     type: ISSUE
     first: 100
     after: $cursor
@@ -83,5 +231,25 @@ query prs($cursor: String) {
       hasNextPage
     }
   }
+  rateLimit {
+    cost
+    remaining
+    resetAt
+  }
+}
+"""
+
+# The number of PRs that match a search. Like PR_QUERY, the second placeholder is the
+# value of an `updated:` qualifier (e.g. `>=2025-01-01T00:00:00Z`).
+PR_COUNT_QUERY = """
+query prs($cursor: String) {
+  search(query: "org:%s is:pr updated:%s", type: ISSUE, first: 0, after: $cursor) {
+    issueCount
+  }
+  rateLimit {
+    cost
+    remaining
+    resetAt
+  }
 }
 """
@@ -0,0 +1,64 @@
+import contextlib
+import datetime
+import json
+import os
+import resource
+import threading
+import time
+
+
+# The path of the run report, a JSON lines file. `python -m tasks` sets it for each run,
+# so that the tasks' worker processes append to the same report. If it isn't set, then
+# nothing is recorded.
+REPORT_PATH_ENV_VAR = "TASKS_REPORT_PATH"
+
+_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Record the duration of the block and the peak memory use when it ends.
+
+    `attrs` are recorded with the span. The block can add attributes, such as the number
+    of rows it processed, to the dict that this yields.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record(
+            "span",
+            name=name,
+            status=status,
+            duration=time.perf_counter() - start,
+            peak_rss=get_peak_rss(),
+            **attrs,
+        )
+
+
+def record(record_type, **fields):
+    """Append a record of type `record_type` to the run report, if there is one."""
+    report_path = os.environ.get(REPORT_PATH_ENV_VAR)
+    if report_path is None:
+        return
+    line = json.dumps(
+        {
+            "type": record_type,
+            "time": datetime.datetime.now(datetime.UTC).isoformat(),
+            "pid": os.getpid(),
+            **fields,
+        },
+        default=str,
+    )
+    with _lock, open(report_path, "a") as f:
+        f.write(line + "\n")
+
+
+def get_peak_rss():
+    """Return the peak resident set size of this process, in bytes."""
+    # Linux, where the tasks run, reports kibibytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -1,41 +1,320 @@
+import collections
 import csv
+import itertools
 import pathlib
+import shutil
+import tempfile
 
+import duckdb
 
-def write(obj, f_path):
+from . import instrumentation
+
+
+# The number of records read into memory at a time
+CHUNK_SIZE = 10_000
+
+
+def write(obj, f_path, schema=None, partition_by=None):
+    """Write records to `f_path`, dispatching on its suffix.
+
+    `obj` is an iterable of records or, for Parquet files, a DuckDB relation, whose rows
+    are written by DuckDB rather than passed through Python.
+
+    `schema` maps field names to DuckDB types (e.g. `{"number": "INTEGER"}`). It is
+    used for Parquet files; if it is omitted, then DuckDB infers the types. A relation's
+    columns are already typed, so it isn't used for relations.
+
+    `partition_by` names a timestamp field. If it is given, then `f_path` is a
+    directory of Hive-style partitions, one for each month of the field's values
+    (e.g. `f_path/month=2025-01/data_0.parquet`). It is used for Parquet files.
+    """
     f_path = pathlib.Path(f_path)
     f_path.parent.mkdir(parents=True, exist_ok=True)
-    match f_path.suffix:
-        case ".csv":
-            _write_csv(obj, f_path)
-        case _:
-            raise ValueError(f"Unsupported file type {f_path.suffix}")
+    with instrumentation.span("io.write", path=f_path) as span:
+        match f_path.suffix:
+            case ".csv":
+                if partition_by is not None:
+                    raise ValueError("Partitioning is only supported for Parquet files")
+                if isinstance(obj, duckdb.DuckDBPyRelation):
+                    raise ValueError("Relations are only supported for Parquet files")
+                span["rows"] = _write_csv(obj, f_path)
+            case ".parquet" if isinstance(obj, duckdb.DuckDBPyRelation):
+                _write_relation(obj, f_path, partition_by)
+                span["rows"] = _count_parquet_rows(f_path)
+            case ".parquet":
+                span["rows"] = _write_parquet(obj, f_path, schema, partition_by)
+            case _:
+                raise ValueError(f"Unsupported file type {f_path.suffix}")
 
 
 def _write_csv(records, f_path):
+    # Return the number of records written
     records = iter(records)
     record_0 = next(records)
+    num_records = 1
     with f_path.open("w", newline="") as f:
         writer = csv.writer(f)
         writer.writerows([record_0._fields, record_0])
-        writer.writerows(records)
+        for num_records, record in enumerate(records, start=2):
+            writer.writerow(record)
+    return num_records
+
+
+def _write_parquet(records, f_path, schema, partition_by):
+    # We stream the records through a temporary CSV file, rather than through Python
+    # objects, so that DuckDB can parse and cast them without holding them in memory.
+    # Empty strings are read as NULL.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = pathlib.Path(tmp_dir) / f_path.with_suffix(".csv").name
+        num_records = _write_csv(records, csv_path)
+        with duckdb.connect() as conn:
+            if schema is None:
+                rel = conn.read_csv(str(csv_path), header=True)
+            else:
+                rel = conn.read_csv(str(csv_path), header=True, dtype=schema)
+            _write_relation(rel, f_path, partition_by)
+            return num_records
+
+
+def _write_relation(rel, f_path, partition_by):
+    if partition_by is None:
+        rel.write_parquet(str(f_path), compression="zstd")
+        return
+
+    month = duckdb.FunctionExpression(
+        "strftime",
+        duckdb.ColumnExpression(partition_by),
+        duckdb.ConstantExpression("%Y-%m"),
+    )
+    rel = rel.select(duckdb.StarExpression(), month.alias("month"))
+    # We write the partitions to a sibling directory and then swap it into place, so that
+    # the previous partitions (or the file written before the records were partitioned)
+    # are removed only when the new partitions are complete, and so that none are left
+    # from a previous write
+    swap_dir = pathlib.Path(
+        tempfile.mkdtemp(prefix=f".{f_path.name}.", dir=f_path.parent)
+    )
+    try:
+        new_path = swap_dir / "new"
+        rel.write_parquet(str(new_path), compression="zstd", partition_by=["month"])
+        if f_path.exists():
+            f_path.rename(swap_dir / "old")
+        new_path.rename(f_path)
+    finally:
+        shutil.rmtree(swap_dir)
+
+
+def _count_parquet_rows(f_path):
+    # Counting a relation's rows would run it again, so we read the number of rows from
+    # the footers of the files that it was written to
+    with duckdb.connect() as conn:
+        (num_rows,) = conn.execute(
+            "SELECT sum(num_rows) FROM parquet_file_metadata(?)",
+            [get_parquet_glob(f_path)],
+        ).fetchone()
+        return num_rows
+
+
+def upsert(records, f_path, schema, key, index=()):
+    """Insert `records` into the store at `f_path`, replacing records with the same key.
+
+    A store is a DuckDB database (e.g. `prs.duckdb`) with one table, which is named after
+    the file (e.g. `prs`). Unlike a CSV or Parquet file, it can be updated without being
+    rewritten. If the table doesn't exist, then it is created with the types in `schema`,
+    a primary key of the fields in `key`, and an index on each field in `index`. If
+    several records have the same key, then the last one is inserted.
+
+    The records are inserted in one transaction, so if an upsert fails, then the records
+    in the store are unchanged. The table and its indexes are created before the
+    transaction, so a failed upsert into a new store leaves it with an empty table. Return
+    the number of records that were new or that were different from the records that they
+    replaced.
+    """
+    f_path = pathlib.Path(f_path)
+    if f_path.suffix != ".duckdb":
+        raise ValueError(f"Unsupported file type {f_path.suffix}")
+    f_path.parent.mkdir(parents=True, exist_ok=True)
+    table = f_path.stem
+    with instrumentation.span("io.upsert", path=f_path) as span:
+        records = iter(records)
+        record_0 = next(records, None)
+        if record_0 is None:
+            span["rows"] = 0
+            return 0
+
+        columns = ", ".join(f"{name} {type_}" for name, type_ in schema.items())
+        # A record replaces a record with the same key only if it is different
+        others = [name for name in schema if name not in key]
+        if others:
+            on_conflict = (
+                "DO UPDATE SET "
+                + ", ".join(f"{name} = excluded.{name}" for name in others)
+                + " WHERE "
+                + " OR ".join(
+                    f"{table}.{name} IS DISTINCT FROM excluded.{name}"
+                    for name in others
+                )
+            )
+        else:
+            on_conflict = "DO NOTHING"
+        # As with Parquet files, we stream the records through a temporary CSV file. We
+        # number them, so that if records have the same key, then the last one wins.
+        Row = collections.namedtuple("Row", ["input_row", *record_0._fields])
+        rows = (
+            Row(i, *record)
+            for i, record in enumerate(itertools.chain([record_0], records))
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = pathlib.Path(tmp_dir) / f"{table}.csv"
+            span["rows"] = _write_csv(rows, csv_path)
+            with duckdb.connect(str(f_path)) as conn:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} "
+                    + f"({columns}, PRIMARY KEY ({', '.join(key)}))"
+                )
+                for name in index:
+                    conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {table}_{name} ON {table} ({name})"
+                    )
+                conn.begin()
+                conn.read_csv(
+                    str(csv_path), header=True, dtype={"input_row": "BIGINT", **schema}
+                ).create_view(f"new_{table}")
+                (num_changes,) = conn.execute(
+                    f"INSERT INTO {table} BY NAME "
+                    + f"SELECT * EXCLUDE (input_row) FROM new_{table} "
+                    + f"QUALIFY row_number() OVER (PARTITION BY {', '.join(key)} "
+                    + "ORDER BY input_row DESC) = 1 "
+                    + f"ON CONFLICT ({', '.join(key)}) {on_conflict}"
+                ).fetchone()
+                conn.commit()
+        span["changes"] = num_changes
+        return num_changes
+
+
+def read_last(record_type, f_path, order_by):
+    """Return the last record in the store at `f_path`, ordered by the `order_by` field,
+    or `None` if the store is empty. If the field is indexed, then this is quick.
+    """
+    f_path = pathlib.Path(f_path)
+    with duckdb.connect(str(f_path), read_only=True) as conn:
+        rel = conn.table(f_path.stem)
+        _check_fields(record_type, rel.columns, f_path)
+        row = rel.order(f"{order_by} DESC").limit(1).fetchone()
+    return None if row is None else record_type._make(row)
 
 
-def read(record_type, f_path):
+def count(f_path, field, value):
+    """Return the number of records in the store at `f_path` whose `field` is `value`.
+    If the field is indexed, then this is quick.
+    """
     f_path = pathlib.Path(f_path)
+    with duckdb.connect(str(f_path), read_only=True) as conn:
+        (num_records,) = conn.execute(
+            f"SELECT count(*) FROM {f_path.stem} WHERE {field} = ?", [value]
+        ).fetchone()
+    return num_records
+
+
+def read(record_type, f_path, order_by=None):
+    return list(iter_records(record_type, f_path, order_by))
+
+
+def iter_records(record_type, f_path, order_by=None):
+    """Lazily read records from `f_path`, holding at most one chunk in memory.
+
+    The fields are checked before the first record is read, so a `ValueError` is
+    raised by this function rather than by the returned iterator.
+
+    `order_by` names the fields to order the records by (e.g. `"updated_at, number"`). It
+    is used for stores; CSV and Parquet files are read in the order they were written.
+    """
+    chunks = _iter_chunks(record_type, f_path, CHUNK_SIZE, order_by)
+    return itertools.chain.from_iterable(chunks)
+
+
+def iter_batches(record_type, f_path, batch_size=CHUNK_SIZE):
+    """Lazily read column batches from `f_path`.
+
+    Each batch is an instance of `record_type` whose fields are lists of at most
+    `batch_size` values.
+    """
+    chunks = _iter_chunks(record_type, f_path, batch_size)
+    return (record_type._make(map(list, zip(*chunk))) for chunk in chunks)
+
+
+def _iter_chunks(record_type, f_path, chunk_size, order_by=None):
+    f_path = pathlib.Path(f_path)
+    if order_by is not None and f_path.suffix != ".duckdb":
+        raise ValueError("Ordering is only supported for stores")
     match f_path.suffix:
         case ".csv":
-            return _read_csv(record_type, f_path)
+            _check_fields(record_type, _read_csv_fieldnames(f_path), f_path)
+            return _iter_csv_chunks(record_type, f_path, chunk_size)
+        case ".parquet":
+            _check_fields(record_type, _read_parquet_fieldnames(f_path), f_path)
+            return _iter_parquet_chunks(record_type, f_path, chunk_size)
+        case ".duckdb":
+            _check_fields(record_type, _read_store_fieldnames(f_path), f_path)
+            return _iter_store_chunks(record_type, f_path, chunk_size, order_by)
         case _:
             raise ValueError(f"Unsupported file type {f_path.suffix}")
 
 
-def _read_csv(record_type, f_path):
+def _read_csv_fieldnames(f_path):
     with f_path.open("r", newline="") as f:
-        reader = csv.DictReader(f)
-        assert reader.fieldnames
-        if tuple(reader.fieldnames) != record_type._fields:
-            raise ValueError(
-                f"Record type {record_type} with fields {record_type._fields} not consistent with records in {f_path} ({reader.fieldnames})"
-            )
-        return [record_type(**record) for record in reader]
+        fieldnames = next(csv.reader(f), None)
+        assert fieldnames
+        return fieldnames
+
+
+def _iter_csv_chunks(record_type, f_path, chunk_size):
+    with f_path.open("r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader)  # skip the header
+        while chunk := [
+            record_type._make(row) for row in itertools.islice(reader, chunk_size)
+        ]:
+            yield chunk
+
+
+def get_parquet_glob(f_path):
+    """Return a glob that matches the Parquet file, or the partitions, at `f_path`."""
+    f_path = pathlib.Path(f_path)
+    if f_path.is_dir():
+        return str(f_path / "*" / "*.parquet")
+    return str(f_path)
+
+
+def _read_parquet_fieldnames(f_path):
+    # The partition column isn't a field, so we don't read it from the partitions' paths
+    with duckdb.connect() as conn:
+        return conn.read_parquet(get_parquet_glob(f_path)).columns
+
+
+def _iter_parquet_chunks(record_type, f_path, chunk_size):
+    with duckdb.connect() as conn:
+        rel = conn.read_parquet(get_parquet_glob(f_path))
+        while chunk := [record_type._make(row) for row in rel.fetchmany(chunk_size)]:
+            yield chunk
+
+
+def _read_store_fieldnames(f_path):
+    with duckdb.connect(str(f_path), read_only=True) as conn:
+        return conn.table(f_path.stem).columns
+
+
+def _iter_store_chunks(record_type, f_path, chunk_size, order_by):
+    with duckdb.connect(str(f_path), read_only=True) as conn:
+        rel = conn.table(f_path.stem)
+        if order_by is not None:
+            rel = rel.order(order_by)
+        while chunk := [record_type._make(row) for row in rel.fetchmany(chunk_size)]:
+            yield chunk
+
+
+def _check_fields(record_type, fieldnames, f_path):
+    if tuple(fieldnames) != record_type._fields:
+        raise ValueError(
+            f"Record type {record_type} with fields {record_type._fields} not consistent with records in {f_path} ({fieldnames})"
+        )
@@ -0,0 +1,160 @@
+import collections
+import concurrent.futures
+import enum
+import json
+import pkgutil
+import traceback
+
+import tasks.tasks
+
+from . import instrumentation
+
+
+Task = collections.namedtuple("Task", ["name", "inputs", "outputs"])
+
+
+class Status(enum.Enum):
+    SUCCEEDED = "succeeded"
+    SKIPPED = "skipped"  # because its inputs haven't changed
+    FAILED = "failed"
+    NOT_RUN = "not run"  # because a task it depends on failed
+
+
+def get_task(name):
+    module = pkgutil.resolve_name(f"{tasks.tasks.__name__}.{name}")
+    return Task(name, list(module.INPUTS), list(module.OUTPUTS))
+
+
+def run_task(name):
+    # This is called in a worker process, so it takes the task's name rather than the
+    # task's module, which can't be pickled. The runner reports that the task failed,
+    # so we report why.
+    try:
+        with instrumentation.span("task", task=name):
+            pkgutil.resolve_name(f"{tasks.tasks.__name__}.{name}").main()
+    except Exception:
+        traceback.print_exc()
+        raise
+
+
+def run(tasks_, executor, state_path, force=False, run_task=run_task):
+    """Run `tasks_` on `executor`, and return a dict of task names to statuses.
+
+    Each task module declares `INPUTS` and `OUTPUTS`, which are lists of paths to files
+    or directories. A task depends on another task if it reads a path that the other
+    task writes, and runs when the tasks it depends on have succeeded. A task is
+    skipped if its inputs haven't changed since it last succeeded. A task without
+    inputs reads an external source (e.g. an API), so it is never skipped.
+
+    The fingerprints of each task's inputs when it last succeeded are stored in
+    `state_path`. If `force` is true, then no task is skipped.
+    """
+    dependencies = get_dependencies(tasks_)
+    state = _read_state(state_path)
+    pending = {task.name: task for task in tasks_}
+    running = {}
+    statuses = {}
+
+    while pending or running:
+        for task in _pop_ready(pending, dependencies, statuses):
+            if any(
+                statuses[d] in (Status.FAILED, Status.NOT_RUN)
+                for d in dependencies[task.name]
+            ):
+                statuses[task.name] = Status.NOT_RUN
+                continue
+            fingerprint = get_fingerprint(task.inputs)
+            if not force and is_up_to_date(task, fingerprint, state.get(task.name)):
+                statuses[task.name] = Status.SKIPPED
+                continue
+            running[executor.submit(run_task, task.name)] = (task, fingerprint)
+
+        if not running:
+            if pending:
+                raise ValueError(f"Tasks {sorted(pending)} depend on each other")
+            break
+
+        done, _ = concurrent.futures.wait(
+            running, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            task, fingerprint = running.pop(future)
+            if future.exception() is None:
+                statuses[task.name] = Status.SUCCEEDED
+                state[task.name] = fingerprint
+                _write_state(state_path, state)
+            else:
+                statuses[task.name] = Status.FAILED
+
+    return statuses
+
+
+def _pop_ready(pending, dependencies, statuses):
+    # A task is ready when the tasks it depends on have finished. Finishing a task
+    # without running it can make other tasks ready, so we repeat until none are.
+    while ready := [
+        name for name in pending if all(d in statuses for d in dependencies[name])
+    ]:
+        for name in ready:
+            yield pending.pop(name)
+
+
+def get_dependencies(tasks_):
+    """Return a dict of task names to the names of the tasks they depend on."""
+    return {
+        task.name: {
+            other.name
+            for other in tasks_
+            if other is not task and _overlap(task.inputs, other.outputs)
+        }
+        for task in tasks_
+    }
+
+
+def _overlap(paths, other_paths):
+    # Paths overlap if they are equal, or if one is inside the other (a directory)
+    return any(
+        path.is_relative_to(other_path) or other_path.is_relative_to(path)
+        for path in paths
+        for other_path in other_paths
+    )
+
+
+def get_fingerprint(paths):
+    """Return the path, size, and last modified time of each file in `paths`.
+
+    A directory's files are included; a missing path is included without a size or
+    last modified time.
+    """
+    fingerprint = []
+    for path in paths:
+        if path.is_dir():
+            files = sorted(p for p in path.rglob("*") if p.is_file())
+        else:
+            files = [path]
+        for file in files:
+            if file.exists():
+                stat = file.stat()
+                fingerprint.append([str(file), stat.st_size, stat.st_mtime_ns])
+            else:
+                fingerprint.append([str(file), None, None])
+    return fingerprint
+
+
+def is_up_to_date(task, fingerprint, last_fingerprint):
+    return (
+        bool(task.inputs)
+        and fingerprint == last_fingerprint
+        and all(output.exists() for output in task.outputs)
+    )
+
+
+def _read_state(state_path):
+    if not state_path.exists():
+        return {}
+    return json.loads(state_path.read_text())
+
+
+def _write_state(state_path, state):
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    state_path.write_text(json.dumps(state, indent=2))
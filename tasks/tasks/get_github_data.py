@@ -1,12 +1,33 @@
 import collections
+import concurrent.futures
+import datetime
+import itertools
+import logging
+import operator
 import os
 import re
 
-from .. import DATA_DIR, github_api, io
+from .. import DATA_DIR, github_api, instrumentation, io
 
 
 GITHUB_DIR = DATA_DIR / "github"
 EARLY_DATE = "1970-01-01T00:00:00Z"
+# The environment variables that hold the GitHub API token for each org
+TOKEN_ENV_VARS = {"opensafely-core": "GITHUB_OPENSAFELY_CORE_TOKEN"}
+# The maximum number of orgs to fetch concurrently
+MAX_WORKERS = 4
+# The maximum number of results returned by a search query
+SEARCH_LIMIT = 1000
+# The number of results in a page of a search query (see `github_api.PR_QUERY`)
+PAGE_SIZE = 100
+# The maximum number of windows of history to backfill concurrently, per org
+BACKFILL_WORKERS = 4
+# The paths that the task reads and writes (see `tasks.runner`). It reads the GitHub
+# API rather than local files, so it has no inputs.
+INPUTS = []
+OUTPUTS = [GITHUB_DIR]
+
+logger = logging.getLogger(__name__)
 
 
 PR = collections.namedtuple(
@@ -24,115 +45,262 @@ PR = collections.namedtuple(
     ],
 )
 
+# The types of the columns in the store. PRs from the GitHub API are strings, as returned
+# by `convert_prs`.
+SCHEMA = {
+    "org": "VARCHAR",
+    "repository": "VARCHAR",
+    "number": "INTEGER",
+    "author": "VARCHAR",
+    "created_at": "TIMESTAMP",
+    "updated_at": "TIMESTAMP",
+    "closed_at": "TIMESTAMP",
+    "merged_at": "TIMESTAMP",
+    "is_draft": "BOOLEAN",
+}
+# The fields that identify a PR, and the field that is indexed, in the store
+KEY = ["org", "repository", "number"]
+INDEX = ["updated_at"]
+
 
 def main():  # pragma: no cover
     client = github_api.Client(
-        {"opensafely-core": os.environ["GITHUB_OPENSAFELY_CORE_TOKEN"]}
+        {org: os.environ[env_var] for org, env_var in TOKEN_ENV_VARS.items()}
     )
-    get_prs(client, "opensafely-core", GITHUB_DIR / "opensafely-core" / "prs.csv")
+    get_all_prs(client, TOKEN_ENV_VARS, GITHUB_DIR, backfill=True)
+
 
+def get_all_prs(client, orgs, directory, backfill=False):
+    """Get the PRs for each org concurrently, in `directory/<org>/prs.duckdb`.
 
-def get_prs(client, org, file):
+    Fetching is dominated by waiting for the GitHub API, so we use threads. The client
+    shares each token's rate limit budget between them.
+    """
+    with concurrent.futures.ThreadPoolExecutor(MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                get_prs, client, org, directory / org / "prs.duckdb", backfill
+            )
+            for org in orgs
+        ]
+        # Raise the first exception, if any, once all orgs have finished
+        for future in futures:
+            future.result()
+
+
+@instrumentation.span("get_prs")
+def get_prs(client, org, file, backfill=False):
     """
-    PRs are in a CSV file, ordered by update time (ascending).
+    PRs are in a store (see `io.upsert`), keyed by org, repository, and number, and indexed by
+    update time.
 
-    We update the local record by querying the GitHub API for PRs updated since the last fetch
-    (determined by the update time of the last record in the file). We repeat this query until it
+    We update the store by querying the GitHub API for PRs updated since the last fetch
+    (determined by the latest update time in the store). We repeat this query until it
     doesn't yield any changes, which drains updates beyond the API's 1000-item search limit.
+    We run often, and usually nothing has been updated, so we first probe for updates with a
+    count, which is much cheaper than a page of PRs (see `has_updates`).
 
-    If the local file is empty then we populate it from the beginning of history.
+    If the store is empty then we populate it from the beginning of history. With
+    `backfill`, we do so by querying windows of history concurrently (see `get_backfill`),
+    before draining updates as above.
 
-    PRs that are already in the local record but which have been updated since the last fetch are
-    overwritten (and bumped to the end of the file).
+    PRs that are already in the store but which have been updated since the last fetch are
+    overwritten.
 
     Note that the filter in the API query uses >=, not >. This is to handle the edge case where an
     update is made after a query returns but with the same (second-granularity) timestamp as the
     last record returned by the query. This means that we always return the last record of the
     previous query as the first record of the new one (or several records if we hit the
-    same-timestamp edge case). These repeat updates are skipped.
+    same-timestamp edge case). These repeat updates don't change the store, so they aren't
+    counted as changes.
+
+    The PRs from each query (or each window of a backfill) are upserted in one transaction,
+    so that if a later query fails, then the next run resumes from here rather than from the
+    beginning. We don't hold the PRs in memory or rewrite the store.
     """
-    old_prs = read_local_data(file)
-    if old_prs:
-        since = old_prs[-1].updated_at
-    else:
+    since = get_since(file)
+    if since is None and backfill:
+        now = datetime.datetime.now(datetime.UTC)
+        for prs in get_backfill(client, org, EARLY_DATE, to_string(now)):
+            save(file, prs)
+        since = get_since(file)
+    if since is None:
         since = EARLY_DATE
 
-    aggregate = {(pr.org, pr.repository, pr.number): pr for pr in old_prs}
-    any_changes = False
-
-    keep_going = True
+    keep_going = has_updates(client, org, since, file)
     while keep_going:
         # Add new PRs and overwrite existing ones that have changed.
-        batch_changes = False
-        for pr in get_updates(client, org, since):
-            key = (pr.org, pr.repository, pr.number)
+        keep_going = save(file, get_updates(client, org, since)) > 0
+        if keep_going:
+            since = get_since(file)
 
-            if key in aggregate and aggregate[key] == pr:
-                # This PR has not changed, skip it. (See function comment above.) Assertion proves
-                # that we really understand what's going on.
-                assert pr.updated_at == since, (since, pr)
-                continue
 
-            if key in aggregate:
-                # Dictionary insertion-order guarantee only holds for first insertion of a key, not
-                # for overwrite by a new value. Remove the old value so that the update goes at the
-                # end of the file.
-                del aggregate[key]
+def get_since(file):
+    """Return the latest update time of the PRs in `file`, or `None` if there are none."""
+    if not file.exists():
+        return None
+    try:
+        pr = io.read_last(PR, file, "updated_at")
+    except ValueError:
+        # The fields in the store do not match our record type. This is probably because we've
+        # added a new field. It's always safe to blow the data away and start again because it's
+        # just a cache.
+        file.unlink()
+        return None
+    return None if pr is None else to_string(pr.updated_at)
 
-            aggregate[key] = pr
-            since = pr.updated_at
-            batch_changes = True
 
-        any_changes = any_changes or batch_changes
-        keep_going = batch_changes
+def save(file, prs):
+    """Upsert `prs` into the store at `file`, and return the number of changes."""
+    return io.upsert(prs, file, SCHEMA, KEY, index=INDEX)
 
-    if any_changes:
-        tmp_file = file.with_suffix(".tmp.csv")
-        io.write(aggregate.values(), tmp_file)
-        tmp_file.replace(file)
 
+def has_updates(client, org, since, file):
+    """Have any PRs been updated at or after `since`, other than those in `file`?
 
-def read_local_data(path):
-    if not path.exists():
-        return []
+    We first probe for PRs updated after `since`. Then, to handle the edge case described
+    in `get_prs`, of an update with the same timestamp as the last record, we probe for
+    PRs updated at `since`, and compare their number with the number in the store.
+    """
+    if client.count(org, github_api.PR_COUNT_QUERY % (org, f">{since}")) > 0:
+        return True
+    num_at_since = io.count(file, "updated_at", since) if file.exists() else 0
+    count = client.count(org, github_api.PR_COUNT_QUERY % (org, f"{since}..{since}"))
+    return count > num_at_since
 
-    try:
-        return io.read(PR, path)
-    except ValueError:
-        # The fields in the file do not match our record type. This is probably because we've added
-        # a new field. It's always safe to blow the data away and start again because it's just a
-        # cache.
-        path.unlink()
+
+def get_updates(client, org, since):
+    prs = client.query(org, github_api.PR_QUERY % (org, f">={since}"))
+    for page in itertools.batched(prs, PAGE_SIZE):
+        yield from convert_prs(org, page)
+
+
+def get_backfill(client, org, start, end):
+    """Yield a list of the PRs updated in each window from `start` to `end` (inclusive),
+    in order of update time (ascending).
+
+    We split the period into windows that each match no more than `SEARCH_LIMIT` PRs (see
+    `get_windows`), so that, unlike `get_updates`, we needn't drain updates beyond the
+    API's search limit one query at a time. Instead, we query the windows concurrently.
+    `get_prs` saves each window's PRs as they are yielded, so if a window fails, then the
+    PRs from the windows before it have been saved, and the next run resumes after them.
+    """
+    windows = get_windows(client, org, start, end)
+    with concurrent.futures.ThreadPoolExecutor(BACKFILL_WORKERS) as executor:
+        # `map` returns results in the order of the windows, and so of update time
+        yield from executor.map(
+            lambda window: list(get_updates_between(client, org, *window)), windows
+        )
+
+
+def get_windows(client, org, start, end):
+    """Split the period from `start` to `end` (inclusive) into consecutive windows.
+
+    We bisect each window that matches more than `SEARCH_LIMIT` PRs, down to one second,
+    and drop windows that don't match any PRs. A one-second window can't be bisected, so
+    if it matches more than `SEARCH_LIMIT` PRs, then the search truncates it, and we log
+    a warning.
+    """
+    count = client.count(org, github_api.PR_COUNT_QUERY % (org, f"{start}..{end}"))
+    if count == 0:
         return []
 
+    start_dt = datetime.datetime.fromisoformat(start)
+    end_dt = datetime.datetime.fromisoformat(end)
+    if count <= SEARCH_LIMIT:
+        return [(start, end)]
+    if end_dt - start_dt < datetime.timedelta(seconds=1):
+        logger.warning(
+            "%s PRs in %s were updated from %s to %s, but only %s will be fetched",
+            count,
+            org,
+            start,
+            end,
+            SEARCH_LIMIT,
+        )
+        return [(start, end)]
+
+    mid_dt = start_dt + (end_dt - start_dt) // 2
+    mid_dt = mid_dt.replace(microsecond=0)
+    next_dt = mid_dt + datetime.timedelta(seconds=1)
+    return get_windows(client, org, start, to_string(mid_dt)) + get_windows(
+        client, org, to_string(next_dt), end
+    )
+
+
+def get_updates_between(client, org, start, end):
+    prs = client.query(org, github_api.PR_QUERY % (org, f"{start}..{end}"))
+    for page in itertools.batched(prs, PAGE_SIZE):
+        yield from convert_prs(org, page)
 
-def get_updates(client, org, since):
-    prs = client.query(org, github_api.PR_QUERY % (org, since))
-    yield from (convert_pr(org, pr) for pr in prs)
 
+def get_node_fields(query):
+    """Return the paths of the fields that `query` selects for each PR node.
+
+    For example, `repository { name }` is `("repository", "name")`.
+    """
+    selection = query[query.index("... on PullRequest") :]
+    paths = []
+    prefixes = []  # the paths of the fields that enclose the current field
+    for token in re.findall(r"\w+|[{}]", selection)[3:]:  # skip "on PullRequest {"
+        if token == "{":
+            prefixes.append(paths.pop())  # the previous field has subfields
+        elif token == "}":
+            if not prefixes:
+                return paths  # the end of the node
+            prefixes.pop()
+        else:
+            paths.append((*(prefixes[-1] if prefixes else ()), token))
+    raise ValueError("The PullRequest selection in the query isn't closed")
+
+
+def compile_converter(node_fields):
+    """Return a function that converts a page of PR nodes into PRs.
+
+    `node_fields` are the paths of the fields of a node (see `get_node_fields`). Nested
+    fields are flattened, so each path's first name, in snake case, is a field of `PR`. We
+    map paths to fields once, here, rather than for each node; the function converts each
+    node with a getter for each field.
+    """
 
-def convert_pr(org, pr):
     def to_snake_case(name):
         # (?<!^) is a negative look-behind assertion to stop matches at the start of the string
         return re.sub(r"(?<!^)([A-Z])", r"_\1", name).lower()
 
-    def to_string(value):
-        if value is None:
-            return ""
-        return str(value)
+    def compile_getter(path):
+        if len(path) == 1:
+            return operator.itemgetter(path[0])
+        get_outer, get_inner = operator.itemgetter(path[0]), compile_getter(path[1:])
+        return lambda node: get_inner(get_outer(node))
+
+    getters = {to_snake_case(path[0]): compile_getter(path) for path in node_fields}
+    keys = {path[0] for path in node_fields}
+    # Check that the query and our record type are in sync
+    assert set(getters) | {"org"} == set(PR._fields)
+    getters = [getters.get(field) for field in PR._fields]  # None for org
 
-    flat = dict(pr)
-    flat["repository"] = pr["repository"]["name"]  # flatten this nested structure
-    flat["author"] = pr["author"]["login"]  # flatten
-    flat["number"] = str(pr["number"])  # the API returns an integer
+    def convert_prs(org, nodes):
+        # Nodes are returned with the fields that the query selects, so we check one
+        # node in each page.
+        assert set(nodes[0]) == keys
+        return [
+            PR._make([org if get is None else to_string(get(node)) for get in getters])
+            for node in nodes
+        ]
 
-    snake = {to_snake_case(key): to_string(value) for key, value in flat.items()}
-    snake["org"] = org
+    return convert_prs
+
+
+# Converts a page of the PR nodes returned by `github_api.PR_QUERY` into PRs
+convert_prs = compile_converter(get_node_fields(github_api.PR_QUERY))
 
-    # Check that the query and our record type are in sync
-    assert set(snake.keys()) == set(PR._fields)
 
-    return PR(**snake)
+def to_string(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return str(value)
 
 
 if __name__ == "__main__":
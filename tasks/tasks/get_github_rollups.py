@@ -0,0 +1,74 @@
+import collections
+
+import duckdb
+
+from .. import io
+from . import get_github_data
+
+
+PRsPerDay = collections.namedtuple(
+    "PRsPerDay", ["date", "num_created", "num_merged", "num_closed"]
+)
+
+SCHEMA = {
+    "date": "DATE",
+    "num_created": "INTEGER",
+    "num_merged": "INTEGER",
+    "num_closed": "INTEGER",
+}
+
+# The paths that the task reads and writes (see `tasks.runner`)
+INPUTS = [
+    get_github_data.GITHUB_DIR / org / "prs.duckdb"
+    for org in get_github_data.TOKEN_ENV_VARS
+]
+OUTPUTS = [
+    get_github_data.GITHUB_DIR / org / "prs_per_day.parquet"
+    for org in get_github_data.TOKEN_ENV_VARS
+]
+
+
+def get_prs_per_day(path):
+    """Count the PRs created, merged, and closed on each day.
+
+    The PRs are in the store at `path` (see `get_github_data`), in the `prs` table.
+    """
+    with duckdb.connect(str(path), read_only=True) as conn:
+        rows = conn.execute(
+            """
+            WITH events AS (
+                SELECT CAST(created_at AS DATE) AS date, 'created' AS event FROM prs
+                UNION ALL
+                SELECT CAST(merged_at AS DATE), 'merged' FROM prs
+                WHERE merged_at IS NOT NULL
+                UNION ALL
+                SELECT CAST(closed_at AS DATE), 'closed' FROM prs
+                WHERE closed_at IS NOT NULL
+            )
+            SELECT
+                date,
+                count(*) FILTER (event = 'created') AS num_created,
+                count(*) FILTER (event = 'merged') AS num_merged,
+                count(*) FILTER (event = 'closed') AS num_closed
+            FROM events
+            GROUP BY date
+            ORDER BY date
+            """
+        ).fetchall()
+    return [PRsPerDay._make(row) for row in rows]
+
+
+def main():  # pragma: no cover
+    # The rollups are small (one row per day), so the Streamlit app can read them instead
+    # of aggregating the PRs on each page view. Run after `get_github_data`.
+    for org in get_github_data.TOKEN_ENV_VARS:
+        org_dir = get_github_data.GITHUB_DIR / org
+        io.write(
+            get_prs_per_day(org_dir / "prs.duckdb"),
+            org_dir / "prs_per_day.parquet",
+            schema=SCHEMA,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,36 @@
 import collections
 
+import duckdb
 import sqlalchemy
 
-from .. import DATA_DIR, db, io
+from .. import DATA_DIR, db, instrumentation, io
 
 
 Record = collections.namedtuple("Record", ["created_at", "id"])
 
+SCHEMA = {"created_at": "TIMESTAMP", "id": "INTEGER"}
+# The field that identifies a codelist, and the field that is indexed, in the store
+KEY = ["id"]
+INDEX = ["created_at"]
 
-def extract(engine, metadata):  # pragma: no cover
+OPENCODELISTS_DIR = DATA_DIR / "opencodelists"
+# The store of events, and the file that it is exported to for the Streamlit app
+STORE_PATH = OPENCODELISTS_DIR / "codelist_create_events.duckdb"
+PATH = OPENCODELISTS_DIR / "codelist_create_events.parquet"
+
+# The paths that the task reads and writes (see `tasks.runner`). It reads the
+# OpenCodelists database, so it is skipped when the database hasn't changed.
+INPUTS = db.get_paths(db.Database.OPENCODELISTS)
+OUTPUTS = [STORE_PATH, PATH]
+
+
+def extract(engine, metadata, since):  # pragma: no cover
     # This is hard to test without a OpenCodelists DB, so we exclude it from coverage.
     codelists = metadata.tables["codelists_codelist"]
     stmt = sqlalchemy.select(codelists.c.created_at, codelists.c.id)
-    with engine.connect() as conn:
-        yield from conn.execute(stmt)
+    if since is not None:
+        stmt = stmt.where(codelists.c.created_at >= since)
+    return db.stream(engine, stmt)
 
 
 def get_records(rows):
@@ -21,15 +38,55 @@ def get_records(rows):
         yield Record(row.created_at.replace(microsecond=0), row.id)
 
 
+def get_watermark(store_path):
+    """Return the latest creation time in the store, or `None` if there is no store.
+
+    Creation times are truncated to the second, so we extract codelists created at or
+    after the watermark. Some of these will be repeats; `save` skips them.
+    """
+    if not store_path.exists():
+        return None
+    record = io.read_last(Record, store_path, "created_at")
+    return None if record is None else record.created_at
+
+
+def save(store_path, records):
+    """Add the records that are new or changed to the store, and return their number."""
+    return io.upsert(records, store_path, SCHEMA, KEY, index=INDEX)
+
+
+def seed(store_path, path):
+    """Seed a new store with the records in `path`, which were extracted before we kept
+    a store.
+    """
+    if store_path.exists() or not path.exists():
+        return 0
+    return save(store_path, io.iter_records(Record, path))
+
+
+def export(store_path, path):
+    with duckdb.connect(str(store_path), read_only=True) as conn:
+        rel = conn.table(store_path.stem).order("created_at, id")
+        io.write(rel, path, partition_by="created_at")
+
+
 def main():  # pragma: no cover
     # This is hard to test without a OpenCodelists DB, so we exclude it from coverage.
+    seed(STORE_PATH, PATH)
+    since = get_watermark(STORE_PATH)
+
     engine = db.get_engine(db.Database.OPENCODELISTS)
-    metadata = db.reflect_metadata(engine)
-    rows = extract(engine, metadata)
+    metadata = db.reflect_metadata(engine, only=["codelists_codelist"])
+    rows = extract(engine, metadata, since)
 
-    records = get_records(rows)
+    with instrumentation.span("extract", since=since) as span:
+        num_added = save(STORE_PATH, get_records(rows))
+        span["rows_added"] = num_added
 
-    io.write(records, DATA_DIR / "opencodelists" / "codelist_create_events.csv")
+    # The Streamlit app reads the exported events, so we only export them when they
+    # change (or haven't been exported)
+    if STORE_PATH.exists() and (num_added or not PATH.exists()):
+        export(STORE_PATH, PATH)
 
 
 if __name__ == "__main__":
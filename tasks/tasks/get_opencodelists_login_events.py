@@ -1,35 +1,188 @@
 import collections
+import concurrent.futures
+import contextlib
+import itertools
+import multiprocessing
+import os
 
+import duckdb
 import sqlalchemy
 
-from .. import DATA_DIR, db, io, utils
+from .. import DATA_DIR, db, instrumentation, io, utils
 
 
 Record = collections.namedtuple("Record", ["logged_in_at", "email_hash"])
 
+SCHEMA = {"logged_in_at": "TIMESTAMP", "email_hash": "VARCHAR"}
+# A user's last login is in each extract until they log in again. The history keeps each
+# login once, so it is keyed by user and time; the time is indexed in the store.
+KEY = ["email_hash", "logged_in_at"]
+INDEX = ["logged_in_at"]
 
-def extract(engine, metadata):  # pragma: no cover
+# A login, as exported for the Streamlit app. Each user is identified by an integer ID
+# rather than by their email hash, which is smaller to store and quicker to compare.
+Login = collections.namedtuple("Login", ["logged_in_at", "user_id"])
+
+# An entry in the dictionary of email hashes to user IDs (see `export`). A user's ID never
+# changes.
+User = collections.namedtuple("User", ["email_hash", "user_id"])
+
+USER_SCHEMA = {"email_hash": "VARCHAR", "user_id": "INTEGER"}
+
+# The number of rows to hash at a time
+BATCH_SIZE = 10_000
+
+# The number of rows below which we hash serially. Starting processes, and passing the
+# emails and hashes between them, costs more than hashing this many emails.
+MIN_ROWS_FOR_PROCESSES = 100_000
+
+OPENCODELISTS_DIR = DATA_DIR / "opencodelists"
+# The history of logins, the dictionary of user IDs, and the file that the history is
+# exported to for the Streamlit app
+HISTORY_PATH = OPENCODELISTS_DIR / "login_events.duckdb"
+USERS_PATH = OPENCODELISTS_DIR / "users.duckdb"
+PATH = OPENCODELISTS_DIR / "login_events.parquet"
+
+# The paths that the task reads and writes (see `tasks.runner`). It reads the
+# OpenCodelists database, so it is skipped when the database hasn't changed.
+INPUTS = db.get_paths(db.Database.OPENCODELISTS)
+OUTPUTS = [HISTORY_PATH, USERS_PATH, PATH]
+
+
+def extract(engine, metadata, since):  # pragma: no cover
     # This is hard to test without a OpenCodelists DB, so we exclude it from coverage.
     users = metadata.tables["opencodelists_user"]
     stmt = sqlalchemy.select(users.c.last_login, users.c.email)
-    with engine.connect() as conn:
-        yield from conn.execute(stmt)
+    if since is not None:
+        stmt = stmt.where(users.c.last_login >= since)
+    return db.stream(engine, stmt)
+
+
+def get_records(rows, executor=None):
+    # We hash a batch of emails at a time, which lets `executor` hash them in parallel.
+    for batch in itertools.batched(rows, BATCH_SIZE):
+        logged_in_ats = [row.last_login.replace(microsecond=0) for row in batch]
+        email_hashes = utils.sha256_many([row.email for row in batch], executor)
+        yield from map(Record, logged_in_ats, email_hashes)
+
+
+def get_executor(num_rows):
+    """Return a process pool with which to hash `num_rows` or more rows, or, if a pool
+    wouldn't be quicker, a context manager for `None`, with which to hash serially.
+    """
+    if (os.cpu_count() or 1) < 2 or num_rows < MIN_ROWS_FOR_PROCESSES:
+        return contextlib.nullcontext()
+    # DuckDB starts threads, and forking a multi-threaded process isn't safe, so we spawn
+    # the processes instead.
+    mp_context = multiprocessing.get_context("spawn")
+    return concurrent.futures.ProcessPoolExecutor(mp_context=mp_context)
 
 
-def get_records(rows):
-    for row in rows:
-        yield Record(row.last_login.replace(microsecond=0), utils.sha256(row.email))
+def get_watermark(history_path):
+    """Return the latest login in the history, or `None` if there is no history.
+
+    Logins are truncated to the second, so we extract users whose last login is at or
+    after the watermark. Some of these will be repeats; `save` skips them.
+    """
+    if not history_path.exists():
+        return None
+    record = io.read_last(Record, history_path, "logged_in_at")
+    return None if record is None else record.logged_in_at
+
+
+def save(history_path, records):
+    """Add the logins in `records` that aren't in the history, and return their number.
+
+    Each extract is compared with the history rather than replacing it, so the history
+    grows with the number of logins rather than with the number of extracts.
+    """
+    return io.upsert(records, history_path, SCHEMA, KEY, index=INDEX)
+
+
+def seed(history_path, path):
+    """Seed a new history with the logins in `path`, which were extracted before we kept
+    a history.
+
+    If `path` was exported from a history, then it has user IDs rather than email hashes,
+    so there is nothing to seed the history with; it is extracted in full instead.
+    """
+    if history_path.exists() or not path.exists():
+        return 0
+    try:
+        records = io.iter_records(Record, path)
+    except ValueError:
+        return 0
+    return save(history_path, records)
+
+
+def export(history_path, users_path, path):
+    """Export the history to `path`, replacing each email hash with a user ID.
+
+    Users in the history who aren't in the dictionary at `users_path` are given the next
+    IDs, in the order of their first logins, and are added to the dictionary. DuckDB does
+    this, and joins the history to the dictionary, so neither is read into memory.
+    """
+    history = history_path.stem
+    users = users_path.stem
+    columns = ", ".join(f"{name} {type_}" for name, type_ in USER_SCHEMA.items())
+    escaped_history_path = str(history_path).replace("'", "''")
+    with duckdb.connect(str(users_path)) as conn:
+        conn.execute(f"ATTACH '{escaped_history_path}' AS history (READ_ONLY)")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {users} ({columns}, PRIMARY KEY (email_hash))"
+        )
+        conn.execute(
+            f"""
+            INSERT INTO {users} BY NAME
+            SELECT
+                email_hash,
+                (SELECT coalesce(max(user_id), 0) FROM {users})
+                    + row_number() OVER (ORDER BY min(logged_in_at), email_hash)
+                    AS user_id,
+            FROM history.{history}
+            ANTI JOIN {users} USING (email_hash)
+            GROUP BY email_hash
+            """
+        )
+        rel = conn.sql(
+            f"""
+            SELECT logged_in_at, user_id
+            FROM history.{history}
+            JOIN {users} USING (email_hash)
+            ORDER BY logged_in_at, user_id
+            """
+        )
+        io.write(rel, path, partition_by="logged_in_at")
 
 
 def main():  # pragma: no cover
     # This is hard to test without a OpenCodelists DB, so we exclude it from coverage.
+    seed(HISTORY_PATH, PATH)
+    since = get_watermark(HISTORY_PATH)
+
     engine = db.get_engine(db.Database.OPENCODELISTS)
-    metadata = db.reflect_metadata(engine)
-    rows = (row for row in extract(engine, metadata) if row.last_login is not None)
+    metadata = db.reflect_metadata(engine, only=["opencodelists_user"])
+    rows = (
+        row for row in extract(engine, metadata, since) if row.last_login is not None
+    )
 
-    records = get_records(rows)
+    # We read enough rows to know whether to hash them in processes
+    head = list(itertools.islice(rows, MIN_ROWS_FOR_PROCESSES))
+    with (
+        instrumentation.span("extract", since=since) as span,
+        get_executor(len(head)) as executor,
+    ):
+        num_added = save(
+            HISTORY_PATH, get_records(itertools.chain(head, rows), executor)
+        )
+        span["rows_added"] = num_added
 
-    io.write(records, DATA_DIR / "opencodelists" / "login_events.csv")
+    # The Streamlit app reads the exported logins, so we only export them when they
+    # change (or haven't been exported with user IDs)
+    if HISTORY_PATH.exists() and (
+        num_added or not PATH.exists() or not USERS_PATH.exists()
+    ):
+        export(HISTORY_PATH, USERS_PATH, PATH)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import collections
+
+import duckdb
+
+from .. import DATA_DIR, io
+
+
+OPENCODELISTS_DIR = DATA_DIR / "opencodelists"
+
+# The paths that the task reads and writes (see `tasks.runner`)
+INPUTS = [
+    OPENCODELISTS_DIR / "login_events.parquet",
+    OPENCODELISTS_DIR / "codelist_create_events.parquet",
+]
+OUTPUTS = [
+    OPENCODELISTS_DIR / "login_events_per_day.parquet",
+    OPENCODELISTS_DIR / "codelist_create_events_per_day.parquet",
+]
+
+
+LoginEventsPerDay = collections.namedtuple(
+    "LoginEventsPerDay", ["date", "count", "num_users"]
+)
+
+LOGIN_EVENTS_PER_DAY_SCHEMA = {
+    "date": "DATE",
+    "count": "INTEGER",
+    "num_users": "INTEGER",
+}
+
+CodelistCreateEventsPerDay = collections.namedtuple(
+    "CodelistCreateEventsPerDay", ["date", "count"]
+)
+
+CODELIST_CREATE_EVENTS_PER_DAY_SCHEMA = {"date": "DATE", "count": "INTEGER"}
+
+
+def get_login_events_per_day(path):
+    with duckdb.connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT
+                CAST(logged_in_at AS DATE) AS date,
+                count(*) AS count,
+                count(DISTINCT user_id) AS num_users
+            FROM read_parquet(?)
+            GROUP BY date
+            ORDER BY date
+            """,
+            [io.get_parquet_glob(path)],
+        ).fetchall()
+    return [LoginEventsPerDay._make(row) for row in rows]
+
+
+def get_codelist_create_events_per_day(path):
+    with duckdb.connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT CAST(created_at AS DATE) AS date, count(*) AS count
+            FROM read_parquet(?)
+            GROUP BY date
+            ORDER BY date
+            """,
+            [io.get_parquet_glob(path)],
+        ).fetchall()
+    return [CodelistCreateEventsPerDay._make(row) for row in rows]
+
+
+def main():  # pragma: no cover
+    # The rollups are small (one row per day), so the Streamlit app can read them instead
+    # of aggregating the events on each page view. Run after the OpenCodelists extracts.
+    io.write(
+        get_login_events_per_day(OPENCODELISTS_DIR / "login_events.parquet"),
+        OPENCODELISTS_DIR / "login_events_per_day.parquet",
+        schema=LOGIN_EVENTS_PER_DAY_SCHEMA,
+    )
+    io.write(
+        get_codelist_create_events_per_day(
+            OPENCODELISTS_DIR / "codelist_create_events.parquet"
+        ),
+        OPENCODELISTS_DIR / "codelist_create_events_per_day.parquet",
+        schema=CODELIST_CREATE_EVENTS_PER_DAY_SCHEMA,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,26 @@
 import hashlib
+import itertools
 
 
 def sha256(text):
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sha256_many(texts, executor=None, chunksize=1_000):
+    """Hash each of `texts`, returning a list of hashes in the same order.
+
+    If `executor` is a `concurrent.futures.ProcessPoolExecutor`, then the texts are
+    hashed in chunks of `chunksize` by its processes. Each chunk is one task, which
+    returns a list of hashes, so that we don't pass each hash between processes.
+    (Hashing short texts doesn't release the GIL, so there's no advantage to a
+    `ThreadPoolExecutor`.)
+    """
+    if executor is None:
+        return _sha256_chunk(texts)
+    chunks = executor.map(_sha256_chunk, itertools.batched(texts, chunksize))
+    return list(itertools.chain.from_iterable(chunks))
+
+
+def _sha256_chunk(texts):
+    # This is called in a worker process, so it's defined at module level
+    return [sha256(text) for text in texts]
@@ -3,6 +3,7 @@ import datetime
 import pandas
 import pytest
 
+import repositories
 from pages.delivery_metrics import Repository, main
 
 
@@ -20,15 +21,15 @@ def test_app():
 
 
 def test_get_prs_created_per_day(tmp_path):
-    prs_csv = tmp_path / "prs.csv"
-    prs_csv.write_text(
-        "number,author,created_at,updated_at,closed_at,merged_at,is_draft\n"
-        + "1,author,2024-01-17T00:00:00Z,,,,False\n"
-        + "2,author,2024-01-18T01:00:00Z,,,,False\n"
-        + "3,author,2024-01-18T02:00:00Z,,,,False\n"
-        + "4,author,2024-01-20T00:00:00Z,,,,False\n"
+    prs_per_day_csv = tmp_path / "prs_per_day.csv"
+    prs_per_day_csv.write_text(
+        "date,num_created,num_merged,num_closed\n"
+        + "2024-01-17,1,0,0\n"
+        + "2024-01-18,2,1,0\n"
+        + "2024-01-20,1,0,1\n"
+        + "2024-01-21,0,1,0\n"  # no PRs created, so outside the date range
     )
-    repository = Repository(prs_csv.as_uri())
+    repository = Repository(prs_per_day_csv.as_uri())
     obs = repository.get_prs_created_per_day()
     exp = pandas.DataFrame(
         {
@@ -42,3 +43,19 @@ def test_get_prs_created_per_day(tmp_path):
         }
     )
     pandas.testing.assert_frame_equal(obs, exp)
+
+
+def test_get_prs_created_per_day_profiled(tmp_path, monkeypatch):
+    profiles = []
+    monkeypatch.setattr(repositories, "PROFILES", profiles)
+    monkeypatch.setenv(repositories.PROFILE_ENV_VAR, "1")
+    prs_per_day_csv = tmp_path / "prs_per_day.csv"
+    prs_per_day_csv.write_text(
+        "date,num_created,num_merged,num_closed\n" + "2024-01-17,1,0,0\n"
+    )
+    repository = Repository(prs_per_day_csv.as_uri())
+    repository.get_prs_created_per_day()
+
+    (profile,) = profiles
+    assert profile.method == "Repository.get_prs_created_per_day"
+    assert profile.rows_scanned > 0
@@ -3,36 +3,50 @@ import datetime
 import pandas
 import pytest
 
-from app import app
+from app import app, repositories
 
 
 class FakeRepository:
-    def get_earliest_login_event_date(self):
-        return datetime.date(2025, 1, 1)
+    def get_login_event_date_bounds(self):
+        return datetime.date(2025, 1, 1), datetime.date(2025, 1, 1)
+
+    def get_opencodelists_metrics(self, from_, to_):
+        counts_per_day = pandas.DataFrame(
+            {"date": [datetime.date(2025, 1, 1)], "count": [1]}
+        )
+        return repositories.OpenCodelistsMetrics(
+            num_users_logged_in=1_000,
+            num_codelists_created=1_000,
+            login_events_per_day=counts_per_day,
+            num_users_logged_in_per_day=counts_per_day,
+            codelist_create_events_per_day=counts_per_day,
+        )
 
-    def get_latest_login_event_date(self):
-        return datetime.date(2025, 1, 1)
 
-    def get_login_events_per_day(self, from_, to_):
-        return pandas.DataFrame({"date": [datetime.date(2025, 1, 1)], "count": [1]})
-
-    def get_num_users_logged_in_per_day(self, from_, to_):
-        return pandas.DataFrame({"date": [datetime.date(2025, 1, 1)], "count": [1]})
-
-    def get_num_users_logged_in(self, from_, to_):
-        return 1_000
-
-    def get_codelist_create_events_per_day(self, from_, to_):
-        return pandas.DataFrame({"date": [datetime.date(2025, 1, 1)], "count": [1]})
+@pytest.mark.slow
+def test_app():
+    from streamlit.testing.v1 import AppTest
 
-    def get_num_codelists_created(self, from_, to_):
-        return 1_000
+    app_test = AppTest.from_function(app.main, args=(FakeRepository(),))
+    app_test.run()
+    assert not app_test.exception
 
 
 @pytest.mark.slow
-def test_app():
+def test_app_with_profiles(monkeypatch):
     from streamlit.testing.v1 import AppTest
 
+    profile = app.repositories.Profile(
+        method="Repository.get_num_users_logged_in",
+        args=(datetime.date(2025, 1, 1), datetime.date(2025, 1, 2)),
+        kwargs={},
+        wall_time=0.1,
+        rows_scanned=1_000,
+        plans=["QUERY"],
+    )
+    monkeypatch.setattr(app.repositories, "PROFILES", [profile])
+    monkeypatch.setenv(app.repositories.PROFILE_ENV_VAR, "1")
     app_test = AppTest.from_function(app.main, args=(FakeRepository(),))
     app_test.run()
     assert not app_test.exception
+    assert app_test.expander[-1].label == "Query profiles"
@@ -1,7 +1,10 @@
 import datetime
+import functools
+import logging
 import pathlib
 from urllib.parse import urlparse
 
+import duckdb
 import pandas
 import pytest
 
@@ -16,14 +19,13 @@ def test_repository_uris_have_valid_paths(tmp_path):
 
 
 def test_get_num_users_logged_in_per_day(tmp_path):
-    login_events_csv = tmp_path / "opencodelists" / "login_events.csv"
-    login_events_csv.parent.mkdir()
-    login_events_csv.write_text(
-        "logged_in_at,email_hash\n"
-        + "2025-01-01 00:00:00,1111111\n"  # left boundary, should be counted
-        + "2025-01-02 00:00:00,1111111\n"  # logged in twice, should be counted once
-        + "2025-01-03 23:59:59,2222222\n"  # right boundary, should be counted
-        + "2025-01-04 00:00:00,3333333\n"  # outside boundary, shouldn't be counted
+    write_partitions(
+        tmp_path / "opencodelists" / "login_events.parquet",
+        "logged_in_at,user_id\n"
+        + "2025-01-01 00:00:00,1\n"  # left boundary, should be counted
+        + "2025-01-02 00:00:00,1\n"  # logged in twice, should be counted once
+        + "2025-01-03 23:59:59,2\n"  # right boundary, should be counted
+        + "2025-01-04 00:00:00,3\n",  # outside boundary, shouldn't be counted
     )
     repository = repositories.Repository(tmp_path.as_uri())
     from_ = datetime.date(2025, 1, 1)
@@ -42,15 +44,43 @@ def test_get_num_users_logged_in_per_day(tmp_path):
     pandas.testing.assert_frame_equal(obs, exp)
 
 
+@pytest.mark.parametrize(
+    "window,exp_from,exp_counts",
+    [
+        (0, datetime.date(2025, 1, 3), [1, 1]),
+        (1, datetime.date(2025, 1, 3), [1, 2, 1]),
+        # The windows of the first user's logins overlap, so they are counted once
+        (4, datetime.date(2025, 1, 1), [1, 1, 1, 2, 2]),
+    ],
+)
+def test_get_num_users_logged_in_per_day_with_window(
+    tmp_path, window, exp_from, exp_counts
+):
+    write_partitions(
+        tmp_path / "opencodelists" / "login_events.parquet",
+        "logged_in_at,user_id\n"
+        + "2024-12-30 00:00:00,1\n"  # before from_, counted within the window
+        + "2025-01-03 00:00:00,1\n"
+        + "2025-01-04 00:00:00,2\n",
+    )
+    repository = repositories.Repository(tmp_path.as_uri())
+    from_ = datetime.date(2025, 1, 1)
+    to_ = datetime.date(2025, 1, 5)
+    obs = repository.get_num_users_logged_in_per_day(from_, to_, window)
+    assert list(obs["date"].dt.date) == [
+        exp_from + datetime.timedelta(days=i) for i in range(len(exp_counts))
+    ]
+    assert list(obs["count"]) == exp_counts
+
+
 def test_repository_get_num_users_logged_in(tmp_path):
-    login_events_csv = tmp_path / "opencodelists" / "login_events.csv"
-    login_events_csv.parent.mkdir()
-    login_events_csv.write_text(
-        "logged_in_at,email_hash\n"
-        + "2025-01-01 00:00:00,1111111\n"  # left boundary, should be counted
-        + "2025-01-02 00:00:00,1111111\n"  # logged in twice, shouldn't be counted
-        + "2025-01-03 23:59:59,2222222\n"  # right boundary, should be counted
-        + "2025-01-04 00:00:00,3333333\n"  # outside boundary, shouldn't be counted
+    write_partitions(
+        tmp_path / "opencodelists" / "login_events.parquet",
+        "logged_in_at,user_id\n"
+        + "2025-01-01 00:00:00,1\n"  # left boundary, should be counted
+        + "2025-01-02 00:00:00,1\n"  # logged in twice, shouldn't be counted
+        + "2025-01-03 23:59:59,2\n"  # right boundary, should be counted
+        + "2025-01-04 00:00:00,3\n",  # outside boundary, shouldn't be counted
     )
     repository = repositories.Repository(tmp_path.as_uri())
     from_ = datetime.date(2025, 1, 1)
@@ -59,47 +89,268 @@ def test_repository_get_num_users_logged_in(tmp_path):
 
 
 def test_repository_get_num_codelists_created(tmp_path):
-    events_csv = tmp_path / "opencodelists" / "codelist_create_events.csv"
-    events_csv.parent.mkdir()
-    events_csv.write_text(
-        "created_at,id\n"
-        + "2025-01-01 00:00:00,1\n"  # left boundary, should be counted
-        + "2025-01-03 23:59:59,2\n"  # right boundary, should be counted
-        + "2025-01-04 00:00:00,3\n"  # outside boundary, shouldn't be counted
+    write_parquet(
+        tmp_path / "opencodelists" / "codelist_create_events_per_day.parquet",
+        "date,count\n"
+        + "2025-01-01,1\n"  # left boundary, should be counted
+        + "2025-01-03,2\n"  # right boundary, should be counted
+        + "2025-01-04,4\n",  # outside boundary, shouldn't be counted
     )
     repository = repositories.Repository(tmp_path.as_uri())
     from_ = datetime.date(2025, 1, 1)
     to_ = datetime.date(2025, 1, 3)
-    assert repository.get_num_codelists_created(from_, to_) == 2
+    assert repository.get_num_codelists_created(from_, to_) == 3
 
 
-def test_get_scalar_result(tmp_path):
-    my_csv = tmp_path / "my.csv"
-    my_csv.write_text("val\n2\n3\n1")
-    scalar_result = repositories._get_scalar_result(my_csv.as_uri(), "max", "val")
-    assert scalar_result == 3
+def test_repository_loads_source_once(tmp_path, monkeypatch):
+    write_parquet(
+        tmp_path / "opencodelists" / "codelist_create_events_per_day.parquet",
+        "date,count\n" + "2025-01-01,1\n",
+    )
+    uris_read = []
 
+    def spy(conn, uri):
+        uris_read.append(uri)
+        return read(conn, uri)
 
-@pytest.mark.filterwarnings(
-    "ignore:The behavior of DatetimeProperties.to_pydatetime is deprecated:FutureWarning"
-)
-def test_get_events_per_day(tmp_path):
-    events_csv = tmp_path / "events.csv"
-    events_csv.write_text(
-        "event_at\n"
-        + "2025-01-01 00:00:00\n"  # left boundary, should be counted
-        + "2025-01-03 23:59:59\n"  # right boundary, should be counted
-        + "2025-01-04 00:00:00\n"  # outside boundary, shouldn't be counted
-    )
-    events_per_day = repositories._get_events_per_day(
-        events_csv.as_uri(),
-        "event_at",
+    read = repositories.read
+    monkeypatch.setattr(repositories, "read", spy)
+    repository = repositories.Repository(tmp_path.as_uri())
+    from_ = datetime.date(2025, 1, 1)
+    to_ = datetime.date(2025, 1, 3)
+    assert repository.get_num_codelists_created(from_, to_) == 1
+    assert repository.get_num_codelists_created(from_, to_) == 1
+    assert len(uris_read) == 1
+
+
+def test_repository_reloads_changed_source(tmp_path):
+    counts_parquet = (
+        tmp_path / "opencodelists" / "codelist_create_events_per_day.parquet"
+    )
+    write_parquet(counts_parquet, "date,count\n" + "2025-01-01,1\n")
+    repository = repositories.Repository(tmp_path.as_uri())
+    from_ = datetime.date(2025, 1, 1)
+    to_ = datetime.date(2025, 1, 3)
+    assert repository.get_num_codelists_created(from_, to_) == 1
+
+    write_parquet(counts_parquet, "date,count\n" + "2025-01-01,1\n" + "2025-01-02,2\n")
+    assert repository.get_num_codelists_created(from_, to_) == 3
+
+
+def test_repository_reads_overlapping_partitions(tmp_path):
+    events_parquet = tmp_path / "opencodelists" / "login_events.parquet"
+    write_partitions(
+        events_parquet,
+        "logged_in_at,user_id\n"
+        + "2024-12-31 00:00:00,1\n"
+        + "2025-01-01 00:00:00,2\n"
+        + "2025-03-01 00:00:00,3\n",
+    )
+    # if this partition were read, then there would be an error
+    (events_parquet / "month=2025-03" / "data_0.parquet").write_text("")
+    repository = repositories.Repository(tmp_path.as_uri())
+    from_ = datetime.date(2025, 1, 1)
+    to_ = datetime.date(2025, 2, 28)
+    assert repository.get_num_users_logged_in(from_, to_) == 1
+
+
+def test_cached_repository(tmp_path):
+    events_parquet = tmp_path / "opencodelists" / "login_events.parquet"
+    write_partitions(events_parquet, "logged_in_at,user_id\n" + "2025-01-01,1\n")
+    repository = repositories.Repository(tmp_path.as_uri())
+    cache = functools.lru_cache(maxsize=2)
+    cached_repository = repositories.CachedRepository(repository, cache)
+    from_ = datetime.date(2025, 1, 1)
+    to_ = datetime.date(2025, 1, 3)
+    assert cached_repository.get_num_users_logged_in(from_, to_) == 1
+    assert cached_repository.get_num_users_logged_in(from_, to_) == 1
+    info = cached_repository._call.cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+
+    # a changed source changes the version, so the result is recomputed
+    write_partitions(
+        events_parquet,
+        "logged_in_at,user_id\n" + "2025-01-01,1\n" + "2025-01-02,2\n",
+    )
+    assert cached_repository.get_num_users_logged_in(from_, to_) == 2
+    info = cached_repository._call.cache_info()
+    assert (info.hits, info.misses) == (1, 2)
+
+
+def test_repository_get_version(tmp_path):
+    events_parquet = tmp_path / "opencodelists" / "login_events.parquet"
+    repository = repositories.Repository(tmp_path.as_uri())
+    assert repository.get_version() == ()
+
+    write_partitions(events_parquet, "logged_in_at,user_id\n" + "2025-01-01,1\n")
+    version = repository.get_version()
+    assert len(version) == 1
+    assert repository.get_version() == version
+
+
+def test_cached_repository_attribute(tmp_path):
+    repository = repositories.Repository(tmp_path.as_uri())
+    cached_repository = repositories.CachedRepository(repository, functools.lru_cache)
+    assert cached_repository.uris == repository.uris
+
+
+@pytest.fixture
+def profiles(monkeypatch):
+    profiles = []
+    monkeypatch.setattr(repositories, "PROFILES", profiles)
+    return profiles
+
+
+def test_profiled(tmp_path, monkeypatch, profiles, caplog):
+    caplog.set_level(logging.INFO)
+    monkeypatch.setenv(repositories.PROFILE_ENV_VAR, "1")
+    write_parquet(
+        tmp_path / "opencodelists" / "codelist_create_events_per_day.parquet",
+        "date,count\n" + "2025-01-01,1\n" + "2025-01-02,2\n",
+    )
+    repository = repositories.Repository(tmp_path.as_uri())
+    from_ = datetime.date(2025, 1, 1)
+    to_ = datetime.date(2025, 1, 3)
+    assert repository.get_num_codelists_created(from_, to_) == 3
+
+    (profile,) = profiles
+    assert profile.method == "Repository.get_num_codelists_created"
+    assert profile.args == (from_, to_)
+    assert profile.wall_time > 0
+    # The source's version is read (1 row), the source is loaded (2 rows), and the
+    # table is queried (2 rows)
+    assert profile.rows_scanned == 5
+    assert any("PARQUET_SCAN" in plan for plan in profile.plans)
+    assert any("TABLE_SCAN" in plan for plan in profile.plans)
+    assert not any("enable_profiling" in plan for plan in profile.plans)
+    assert "Repository.get_num_codelists_created" in caplog.text
+
+
+def test_keyword_arguments(tmp_path, monkeypatch, profiles):
+    monkeypatch.setenv(repositories.PROFILE_ENV_VAR, "1")
+    write_partitions(
+        tmp_path / "opencodelists" / "login_events.parquet",
+        "logged_in_at,user_id\n" + "2025-01-01 00:00:00,1\n",
+    )
+    repository = repositories.Repository(tmp_path.as_uri())
+    cached_repository = repositories.CachedRepository(
+        repository, functools.lru_cache(maxsize=2)
+    )
+    from_ = datetime.date(2025, 1, 1)
+    to_ = datetime.date(2025, 1, 3)
+
+    # Keyword arguments are passed through both wrappers, and are part of the cache key
+    obs_0 = cached_repository.get_num_users_logged_in_per_day(from_, to_, window=0)
+    obs_1 = cached_repository.get_num_users_logged_in_per_day(from_, to_, window=1)
+    assert list(obs_0["count"]) == [1]
+    assert list(obs_1["count"]) == [1, 1]
+
+    assert [profile.kwargs for profile in profiles] == [{"window": 0}, {"window": 1}]
+    assert repositories.format_call(profiles[0]) == (
+        "Repository.get_num_users_logged_in_per_day("
+        + "datetime.date(2025, 1, 1), datetime.date(2025, 1, 3), window=0)"
+    )
+
+
+def test_profiled_not_enabled(tmp_path, monkeypatch, profiles):
+    monkeypatch.delenv(repositories.PROFILE_ENV_VAR, raising=False)
+    write_parquet(
+        tmp_path / "opencodelists" / "codelist_create_events_per_day.parquet",
+        "date,count\n" + "2025-01-01,1\n",
+    )
+    repository = repositories.Repository(tmp_path.as_uri())
+    from_ = datetime.date(2025, 1, 1)
+    assert repository.get_num_codelists_created(from_, from_) == 1
+    assert profiles == []
+
+
+def test_read_parquet(tmp_path):
+    my_parquet = tmp_path / "my.parquet"
+    write_parquet(my_parquet, "val\n1\n2\n")
+    with duckdb.connect() as conn:
+        rel = repositories.read(conn, my_parquet.as_uri())
+        assert rel.fetchall() == [(1,), (2,)]
+
+
+def test_read_unsupported_file_type(tmp_path):
+    with duckdb.connect() as conn:
+        with pytest.raises(ValueError, match="Unsupported file type .json"):
+            repositories.read(conn, (tmp_path / "my.json").as_uri())
+
+
+def test_repository_get_login_event_date_bounds(tmp_path):
+    write_parquet(
+        tmp_path / "opencodelists" / "login_events_per_day.parquet",
+        "date,count,num_users\n" + "2025-01-02,1,1\n" + "2025-01-01,2,2\n",
+    )
+    repository = repositories.Repository(tmp_path.as_uri())
+    assert repository.get_login_event_date_bounds() == (
         datetime.date(2025, 1, 1),
-        datetime.date(2025, 1, 3),
+        datetime.date(2025, 1, 2),
+    )
+
+
+def test_repository_get_opencodelists_metrics(tmp_path):
+    write_partitions(
+        tmp_path / "opencodelists" / "login_events.parquet",
+        "logged_in_at,user_id\n"
+        + "2025-01-01 00:00:00,1\n"
+        + "2025-01-03 23:59:59,2\n"
+        + "2025-01-04 00:00:00,3\n",  # outside boundary, shouldn't be counted
     )
-    assert list(events_per_day["date"].dt.to_pydatetime()) == [
+    write_parquet(
+        tmp_path / "opencodelists" / "login_events_per_day.parquet",
+        "date,count,num_users\n"
+        + "2025-01-01,1,1\n"
+        + "2025-01-03,1,1\n"
+        + "2025-01-04,1,1\n",  # outside boundary, shouldn't be included
+    )
+    write_parquet(
+        tmp_path / "opencodelists" / "codelist_create_events_per_day.parquet",
+        "date,count\n"
+        + "2025-01-01,1\n"
+        + "2025-01-03,2\n"
+        + "2025-01-04,4\n",  # outside boundary, shouldn't be included
+    )
+    repository = repositories.Repository(tmp_path.as_uri())
+    from_ = datetime.date(2025, 1, 1)
+    to_ = datetime.date(2025, 1, 3)
+    metrics = repository.get_opencodelists_metrics(from_, to_)
+
+    assert metrics.num_users_logged_in == 2
+    assert metrics.num_codelists_created == 3
+    dates = [
         datetime.datetime(2025, 1, 1),
         datetime.datetime(2025, 1, 2),  # not in fixture data
         datetime.datetime(2025, 1, 3),
     ]
-    assert list(events_per_day["count"]) == [1, 0, 1]
+    assert list(metrics.login_events_per_day["date"]) == dates
+    assert list(metrics.login_events_per_day["count"]) == [1, 0, 1]
+    assert list(metrics.codelist_create_events_per_day["date"]) == dates
+    assert list(metrics.codelist_create_events_per_day["count"]) == [1, 0, 2]
+    pandas.testing.assert_frame_equal(
+        metrics.num_users_logged_in_per_day,
+        repository.get_num_users_logged_in_per_day(from_, to_),
+    )
+
+
+def write_parquet(f_path, text):
+    f_path.parent.mkdir(exist_ok=True)
+    csv_path = f_path.with_suffix(".csv")
+    csv_path.write_text(text)
+    with duckdb.connect() as conn:
+        conn.read_csv(str(csv_path)).write_parquet(str(f_path))
+    csv_path.unlink()
+
+
+def write_partitions(f_path, text):
+    """Write `text`, which is CSV-formatted login events, to monthly partitions."""
+    f_path.parent.mkdir(exist_ok=True)
+    csv_path = f_path.with_suffix(".csv")
+    csv_path.write_text(text)
+    with duckdb.connect() as conn:
+        conn.read_csv(str(csv_path)).query(
+            "login_events",
+            "SELECT *, strftime(logged_in_at, '%Y-%m') AS month FROM login_events",
+        ).write_parquet(str(f_path), partition_by=["month"], overwrite=True)
+    csv_path.unlink()
@@ -0,0 +1,65 @@
+import duckdb
+
+import repositories
+from benchmarks import data
+from tasks import io
+from tasks.tasks import get_github_data
+
+
+def test_generate(tmp_path):
+    data.generate(tmp_path, 1_000)
+
+    repository = repositories.Repository(tmp_path.as_uri())
+    earliest, latest = repository.get_login_event_date_bounds()
+    assert data.START.date() <= earliest < latest <= data.END.date()
+    assert (
+        repository.get_num_codelists_created(data.START.date(), data.END.date())
+        == 1_000
+    )
+
+    prs = io.read(get_github_data.PR, tmp_path / "github" / data.ORG / "prs.duckdb")
+    assert len(prs) == 1_000
+    assert len({(pr.repository, pr.number) for pr in prs}) == 1_000
+
+
+def test_generate_is_repeatable(tmp_path):
+    data.generate(tmp_path / "a", 100)
+    data.generate(tmp_path / "b", 100)
+
+    def read(directory):
+        with duckdb.connect() as conn:
+            return {
+                path.relative_to(directory): conn.read_parquet(str(path))
+                .order("ALL")
+                .fetchall()
+                for path in directory.rglob("*.parquet")
+                if path.is_file()
+            } | {
+                path.relative_to(directory): io.read(
+                    get_github_data.PR, path, order_by="ALL"
+                )
+                for path in directory.rglob("*.duckdb")
+            }
+
+    assert read(tmp_path / "a") == read(tmp_path / "b")
+
+
+def test_get_pr_nodes(tmp_path):
+    data.generate(tmp_path, 100)
+    org_dir = tmp_path / "github" / data.ORG
+
+    nodes = data.get_pr_nodes(org_dir, 4)
+
+    prs = get_github_data.convert_prs(data.ORG, nodes)
+    existing = {
+        (pr.repository, str(pr.number)): pr
+        for pr in io.read(get_github_data.PR, org_dir / "prs.duckdb")
+    }
+    assert [(pr.repository, pr.number) in existing for pr in prs] == [
+        False,
+        True,
+        False,
+        True,
+    ]
+    latest = get_github_data.to_string(max(pr.updated_at for pr in existing.values()))
+    assert all(pr.updated_at > latest for pr in prs)
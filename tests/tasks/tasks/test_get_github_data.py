@@ -1,8 +1,10 @@
 import collections
+import datetime
+import re
 
 import pytest
 
-from tasks import io
+from tasks import github_api, io
 from tasks.tasks import get_github_data
 from tasks.tasks.get_github_data import PR
 
@@ -11,6 +13,7 @@ class FakeClient:
     def __init__(self, *batches):
         self._batches = list(batches)
         self.queries = []
+        self.counts = []
 
     def query(self, org, query):
         self.queries.append(query)
@@ -18,6 +21,137 @@ class FakeClient:
             return []
         return self._batches.pop(0)
 
+    def count(self, org, query):
+        # There are updates if the next batch isn't empty
+        self.counts.append(query)
+        return int(bool(self._batches) and self._batches[0] != [])
+
+
+class FakeOrgsClient:
+    def __init__(self, prs_by_org):
+        self._prs_by_org = prs_by_org
+
+    def query(self, org, query):
+        return self._prs_by_org.pop(org, [])
+
+    def count(self, org, query):
+        return len(self._prs_by_org.get(org, []))
+
+
+def test_get_all_prs(tmp_path):
+    client = FakeOrgsClient({"org-a": [gh_pr(number=1)], "org-b": [gh_pr(number=2)]})
+
+    get_github_data.get_all_prs(client, ["org-a", "org-b"], tmp_path)
+
+    prs_a = io.read(PR, tmp_path / "org-a" / "prs.duckdb")
+    prs_b = io.read(PR, tmp_path / "org-b" / "prs.duckdb")
+    assert [(pr.org, pr.number) for pr in prs_a + prs_b] == [("org-a", 1), ("org-b", 2)]
+
+
+class FakeSearchClient:
+    """Answers searches for PRs updated in a window, like the GitHub API."""
+
+    def __init__(self, prs):
+        self._prs = sorted(prs, key=lambda pr: pr["updatedAt"])
+        self.counts = []
+
+    def query(self, org, query):
+        return self._search(query)
+
+    def count(self, org, query):
+        self.counts.append(query)
+        return len(self._search(query))
+
+    def _search(self, query):
+        updated = re.search(r"updated:(\S+?)\"", query).group(1)
+        if updated.startswith(">="):
+            start, end = updated.removeprefix(">="), "9999"
+        elif updated.startswith(">"):
+            start, end = updated.removeprefix(">") + "~", "9999"  # "~" sorts after "Z"
+        else:
+            start, end = updated.split("..")
+        return [pr for pr in self._prs if start <= pr["updatedAt"] <= end]
+
+
+def test_get_windows(monkeypatch):
+    monkeypatch.setattr(get_github_data, "SEARCH_LIMIT", 2)
+    client = FakeSearchClient(
+        [
+            gh_pr(number=1, updated="2000-01-01T00:00:00Z"),
+            gh_pr(number=2, updated="2000-01-02T00:00:00Z"),
+            gh_pr(number=3, updated="2000-01-03T00:00:00Z"),
+        ]
+    )
+
+    windows = get_github_data.get_windows(
+        client, "org", "2000-01-01T00:00:00Z", "2000-01-04T00:00:00Z"
+    )
+
+    assert windows == [
+        ("2000-01-01T00:00:00Z", "2000-01-02T12:00:00Z"),
+        ("2000-01-02T12:00:01Z", "2000-01-04T00:00:00Z"),
+    ]
+
+
+def test_get_windows_stops_bisecting_at_one_second(monkeypatch, caplog):
+    monkeypatch.setattr(get_github_data, "SEARCH_LIMIT", 1)
+    client = FakeSearchClient(
+        [
+            gh_pr(number=1, updated="2000-01-01T00:00:00Z"),
+            gh_pr(number=2, updated="2000-01-01T00:00:00Z"),
+        ]
+    )
+
+    windows = get_github_data.get_windows(
+        client, "org", "2000-01-01T00:00:00Z", "2000-01-01T00:00:01Z"
+    )
+
+    assert windows == [("2000-01-01T00:00:00Z", "2000-01-01T00:00:00Z")]
+    # The search truncates the window, which we warn about
+    (record,) = caplog.records
+    assert record.levelname == "WARNING"
+    assert "only 1 will be fetched" in record.getMessage()
+
+
+def test_backfill(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_github_data, "SEARCH_LIMIT", 2)
+    prs = [gh_pr(number=i, updated=f"2000-01-0{i}T00:00:00Z") for i in range(1, 6)]
+    client = FakeSearchClient(prs)
+    path = tmp_path / "prs.duckdb"
+
+    get_github_data.get_prs(client, "org", path, backfill=True)
+
+    assert len(client.counts) > 1  # history was split into windows
+    assert load_prs(path) == [
+        local_pr(number=i, updated=f"2000-01-0{i}T00:00:00Z") for i in range(1, 6)
+    ]
+
+
+def test_backfill_saves_windows_before_failure(tmp_path, monkeypatch):
+    class FailingSearchClient(FakeSearchClient):
+        def query(self, org, query):
+            prs = super().query(org, query)
+            if any(pr["number"] == 5 for pr in prs):
+                raise RuntimeError("GraphQL query failed")
+            return prs
+
+    monkeypatch.setattr(get_github_data, "SEARCH_LIMIT", 2)
+    prs = [gh_pr(number=i, updated=f"2000-01-0{i}T00:00:00Z") for i in range(1, 6)]
+    path = tmp_path / "prs.duckdb"
+
+    with pytest.raises(RuntimeError):
+        get_github_data.get_prs(FailingSearchClient(prs), "org", path, backfill=True)
+
+    # The windows before the failed window were saved, so the next run resumes after them
+    assert [pr.number for pr in load_prs(path)] == ["1", "2", "3"]
+    assert get_github_data.get_since(path) == "2000-01-03T00:00:00Z"
+
+
+def test_backfill_writes_nothing_if_no_prs_returned(tmp_path):
+    path = tmp_path / "prs.duckdb"
+    get_github_data.get_prs(FakeSearchClient([]), "org", path, backfill=True)
+    assert not path.exists()
+
 
 def test_writes_nothing_if_no_prs_returned(tmp_path):
     path, _ = run(tmp_path, prs=[])
@@ -26,21 +160,21 @@ def test_writes_nothing_if_no_prs_returned(tmp_path):
 
 def test_populate_initial_prs(tmp_path):
     path, _ = run(tmp_path, prs=[gh_pr(number=1)])
-    prs = io.read(PR, path)
+    prs = load_prs(path)
     assert prs == [local_pr(number=1)]
 
 
 def test_append_new_prs(tmp_path):
     run(tmp_path, prs=[gh_pr(number=1)])
     path, _ = run(tmp_path, prs=[gh_pr(number=2)])
-    prs = io.read(PR, path)
+    prs = load_prs(path)
     assert prs == [local_pr(number=1), local_pr(number=2)]
 
 
 def test_maintains_ordering_of_old_and_new_prs(tmp_path):
     run(tmp_path, prs=[gh_pr(number=1), gh_pr(number=2)])
     path, _ = run(tmp_path, prs=[gh_pr(number=3), gh_pr(number=4)])
-    prs = io.read(PR, path)
+    prs = load_prs(path)
     assert prs == [
         local_pr(number=1),
         local_pr(number=2),
@@ -60,9 +194,9 @@ def test_updated_pr(tmp_path):
         tmp_path,
         prs=[gh_pr(number=3), gh_pr(number=1, updated="2020-01-01T00:00:00Z")],
     )
-    prs = io.read(PR, path)
+    prs = load_prs(path)
 
-    # PR 1 is moved to the end of the list and updated
+    # PR 1 is updated, and so is last in order of update time
     assert prs == [
         local_pr(number=2),
         local_pr(number=3),
@@ -70,6 +204,22 @@ def test_updated_pr(tmp_path):
     ]
 
 
+def test_only_changes_are_saved(tmp_path):
+    path = tmp_path / "prs.duckdb"
+    assert get_github_data.save(path, [local_pr(number=1), local_pr(number=2)]) == 2
+
+    num_changes = get_github_data.save(
+        path,
+        [local_pr(number=1), local_pr(number=2, updated="2020-01-01T00:00:00Z")],
+    )
+
+    assert num_changes == 1
+    assert load_prs(path) == [
+        local_pr(number=1),
+        local_pr(number=2, updated="2020-01-01T00:00:00Z"),
+    ]
+
+
 def test_get_prs_repeats_until_no_changes(tmp_path):
     prs = [
         [gh_pr(number=1, updated="2000-01-01T00:00:00Z")],
@@ -80,12 +230,30 @@ def test_get_prs_repeats_until_no_changes(tmp_path):
         [gh_pr(number=2, updated="2000-01-02T00:00:00Z")],
     ]
 
-    _, client = run(tmp_path / "prs.csv", prs)
+    _, client = run(tmp_path, prs)
 
     assert len(client.queries) == 3
     assert "updated:>=2000-01-02T00:00:00Z" in client.queries[-1]
 
 
+def test_get_prs_resumes_after_failure(tmp_path):
+    def failing_batch():
+        raise RuntimeError("GraphQL query failed")
+        yield
+
+    prs = [
+        [gh_pr(number=1, updated="2000-01-01T00:00:00Z")],
+        failing_batch(),
+    ]
+    with pytest.raises(RuntimeError):
+        run(tmp_path, prs)
+
+    # The first query's PRs were saved, so the next run starts from there
+    path, client = run(tmp_path, prs=[gh_pr(number=1, updated="2000-01-01T00:00:00Z")])
+    assert load_prs(path) == [local_pr(number=1, updated="2000-01-01T00:00:00Z")]
+    assert "updated:>=2000-01-01T00:00:00Z" in client.queries[-1]
+
+
 def test_filters_on_last_update_time(tmp_path):
     prs = [
         gh_pr(number=1, updated="2000-01-01T00:00:00Z"),
@@ -93,26 +261,86 @@ def test_filters_on_last_update_time(tmp_path):
     ]
     run(tmp_path, prs)
 
+    _, client = run(tmp_path, prs=[gh_pr(number=3, updated="2002-01-01T00:00:00Z")])
+
+    assert "updated:>2001-01-01T00:00:00Z" in client.counts[0]
+    assert "updated:>=2001-01-01T00:00:00Z" in client.queries[0]
+
+
+def test_probes_for_updates_before_querying(tmp_path):
+    run(tmp_path, prs=[gh_pr(number=1)])
+
     _, client = run(tmp_path, prs=[])
 
-    assert "updated:>=2001-01-01T00:00:00Z" in client.queries[-1]
+    # One probe for PRs updated after the last PR, and one for PRs updated with it
+    assert len(client.counts) == 2
+    assert client.queries == []
+
+
+def test_probes_for_updates_in_the_same_second(tmp_path):
+    path = tmp_path / "prs.duckdb"
+    pr_1 = gh_pr(number=1, updated="2000-01-01T00:00:00Z")
+    get_github_data.get_prs(FakeSearchClient([pr_1]), "org", path)
+
+    # PR 2 was updated in the same second as PR 1, after PR 1 was fetched
+    pr_2 = gh_pr(number=2, updated="2000-01-01T00:00:00Z")
+    get_github_data.get_prs(FakeSearchClient([pr_1, pr_2]), "org", path)
+
+    assert [pr.number for pr in load_prs(path)] == ["1", "2"]
+
+
+def test_has_no_updates_in_the_same_second(tmp_path):
+    path = tmp_path / "prs.duckdb"
+    pr_1 = gh_pr(number=1, updated="2000-01-01T00:00:00Z")
+    get_github_data.get_prs(FakeSearchClient([pr_1]), "org", path)
+
+    assert not get_github_data.has_updates(
+        FakeSearchClient([pr_1]), "org", "2000-01-01T00:00:00Z", path
+    )
 
 
 def test_sort_by_update_time(tmp_path):
-    _, client = run(tmp_path, prs=[])
+    _, client = run(tmp_path, prs=[gh_pr(number=1)])
     assert "sort:updated-asc" in client.queries[-1]
 
 
-def test_schema_mismatch_deletes_cache(tmp_path):
-    prs_path = tmp_path / "org" / "prs.csv"
+def test_store_is_typed(tmp_path):
+    path, _ = run(tmp_path, prs=[gh_pr(number=1)])
+    prs = io.read(PR, path)
+    assert prs == [
+        PR(
+            "org",
+            "repo",
+            1,
+            "author",
+            datetime.datetime(1990, 1, 1),
+            datetime.datetime(1990, 1, 1),
+            None,
+            None,
+            False,
+        )
+    ]
+
 
-    WrongType = collections.namedtuple("WrongType", ["aField"])
-    io.write([WrongType("value")], prs_path)
+def test_unchanged_prs_are_skipped(tmp_path):
+    prs = [gh_pr(number=1, updated="2000-01-01T00:00:00Z")]
+    run(tmp_path, prs)
 
-    results = get_github_data.read_local_data(prs_path)
+    # The PR is returned again, but hasn't changed, so it is skipped
+    path, client = run(tmp_path, prs)
 
-    assert not results
-    assert not prs_path.exists()
+    assert len(client.queries) == 1
+    assert "updated:>=2000-01-01T00:00:00Z" in client.queries[-1]
+    assert load_prs(path) == [local_pr(number=1, updated="2000-01-01T00:00:00Z")]
+
+
+def test_schema_mismatch_deletes_cache(tmp_path):
+    path = tmp_path / "org" / "prs.duckdb"
+    WrongType = collections.namedtuple("WrongType", ["a_field"])
+    io.upsert([WrongType("value")], path, {"a_field": "VARCHAR"}, ["a_field"])
+
+    assert get_github_data.get_since(path) is None
+    assert not path.exists()
 
 
 def test_asserts_that_query_returns_expected_fields(tmp_path):
@@ -122,6 +350,35 @@ def test_asserts_that_query_returns_expected_fields(tmp_path):
         run(tmp_path, [pr])
 
 
+def test_get_node_fields():
+    assert get_github_data.get_node_fields(github_api.PR_QUERY) == [
+        ("repository", "name"),
+        ("number",),
+        ("author", "login"),
+        ("createdAt",),
+        ("updatedAt",),
+        ("closedAt",),
+        ("mergedAt",),
+        ("isDraft",),
+    ]
+
+
+def test_get_node_fields_with_unclosed_selection():
+    with pytest.raises(ValueError, match="isn't closed"):
+        get_github_data.get_node_fields("... on PullRequest { number")
+
+
+def test_convert_prs():
+    prs = get_github_data.convert_prs("org", [gh_pr(number=1), gh_pr(number=2)])
+    assert prs == [local_pr(number=1), local_pr(number=2)]
+
+
+def test_compile_converter_asserts_that_query_selects_expected_fields():
+    node_fields = get_github_data.get_node_fields(github_api.PR_QUERY)
+    with pytest.raises(AssertionError):
+        get_github_data.compile_converter(node_fields[:-1])
+
+
 def local_pr(number=0, updated="1990-01-01T00:00:00Z"):
     return PR(
         "org",
@@ -149,8 +406,14 @@ def gh_pr(number=0, updated="1990-01-01T00:00:00Z"):
     )
 
 
+def load_prs(path):
+    # Return the PRs as strings, as returned by `convert_prs`, in order of update time
+    prs = io.read(PR, path, order_by="updated_at, number")
+    return [PR._make(map(get_github_data.to_string, pr)) for pr in prs]
+
+
 def run(root, prs):
-    file = root / "prs.csv"
+    file = root / "prs.duckdb"
     if len(prs) == 0 or not isinstance(prs[0], list):
         prs = [prs]
     client = FakeClient(*prs)
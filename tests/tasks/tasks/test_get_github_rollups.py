@@ -0,0 +1,41 @@
+import datetime
+
+from tasks.tasks import get_github_data, get_github_rollups
+from tasks.tasks.get_github_data import PR
+from tasks.tasks.get_github_rollups import PRsPerDay
+
+
+def test_get_prs_per_day(tmp_path):
+    path = tmp_path / "prs.duckdb"
+    get_github_data.save(
+        path,
+        [
+            pr(1, created="2025-01-01T09:00:00Z"),
+            pr(2, created="2025-01-01T10:00:00Z", closed="2025-01-03T00:00:00Z"),
+        ],
+    )
+    # PR 1 has been merged since it was saved
+    get_github_data.save(
+        path,
+        [
+            pr(
+                1,
+                created="2025-01-01T09:00:00Z",
+                merged="2025-01-02T00:00:00Z",
+                closed="2025-01-02T00:00:00Z",
+            )
+        ],
+    )
+
+    assert get_github_rollups.get_prs_per_day(path) == [
+        PRsPerDay(datetime.date(2025, 1, 1), 2, 0, 0),
+        PRsPerDay(datetime.date(2025, 1, 2), 0, 1, 1),
+        PRsPerDay(datetime.date(2025, 1, 3), 0, 0, 1),
+    ]
+
+
+def pr(number, created, merged="", closed=""):
+    updated = max(created, merged, closed)
+    return PR(
+        "org", "repo", str(number), "author", created, updated, closed, merged, "False"
+    )
@@ -1,7 +1,11 @@
 import collections
 import datetime
 
+import duckdb
+
+from tasks import io
 from tasks.tasks import get_opencodelists_codelist_create_events
+from tasks.tasks.get_opencodelists_codelist_create_events import Record
 
 
 Row = collections.namedtuple("Row", ["created_at", "id"])
@@ -13,3 +17,83 @@ def test_get_records():
     record = records[0]
     assert record.created_at == datetime.datetime(2025, 1, 1, microsecond=0)
     assert record.id == 1
+
+
+def test_get_watermark(tmp_path):
+    store_path = tmp_path / "codelist_create_events.duckdb"
+    assert get_opencodelists_codelist_create_events.get_watermark(store_path) is None
+
+    get_opencodelists_codelist_create_events.save(
+        store_path,
+        [
+            Record(datetime.datetime(2025, 1, 2), 2),
+            Record(datetime.datetime(2025, 1, 1), 1),
+        ],
+    )
+    watermark = get_opencodelists_codelist_create_events.get_watermark(store_path)
+    assert watermark == datetime.datetime(2025, 1, 2)
+
+
+def test_get_watermark_of_empty_store(tmp_path):
+    store_path = tmp_path / "codelist_create_events.duckdb"
+    get_opencodelists_codelist_create_events.save(
+        store_path, [Record(datetime.datetime(2025, 1, 1), 1)]
+    )
+    with duckdb.connect(str(store_path)) as conn:
+        conn.execute("DELETE FROM codelist_create_events")
+
+    assert get_opencodelists_codelist_create_events.get_watermark(store_path) is None
+
+
+def test_save(tmp_path):
+    store_path = tmp_path / "codelist_create_events.duckdb"
+    get_opencodelists_codelist_create_events.save(
+        store_path, [Record(datetime.datetime(2025, 1, 1), 1)]
+    )
+
+    num_added = get_opencodelists_codelist_create_events.save(
+        store_path,
+        [
+            Record(datetime.datetime(2025, 1, 1), 1),  # repeat
+            Record(datetime.datetime(2025, 1, 2), 2),
+        ],
+    )
+
+    assert num_added == 1
+    assert io.read(Record, store_path, order_by="id") == [
+        Record(datetime.datetime(2025, 1, 1), 1),
+        Record(datetime.datetime(2025, 1, 2), 2),
+    ]
+
+
+def test_seed(tmp_path):
+    store_path = tmp_path / "codelist_create_events.duckdb"
+    path = tmp_path / "codelist_create_events.parquet"
+    assert get_opencodelists_codelist_create_events.seed(store_path, path) == 0
+    assert not store_path.exists()
+
+    record = Record(datetime.datetime(2025, 1, 1), 1)
+    io.write([record], path, partition_by="created_at")
+    assert get_opencodelists_codelist_create_events.seed(store_path, path) == 1
+    assert io.read(Record, store_path) == [record]
+
+    # A store is only seeded once
+    assert get_opencodelists_codelist_create_events.seed(store_path, path) == 0
+
+
+def test_export(tmp_path):
+    store_path = tmp_path / "codelist_create_events.duckdb"
+    path = tmp_path / "codelist_create_events.parquet"
+    records = [
+        Record(datetime.datetime(2025, 2, 1), 2),
+        Record(datetime.datetime(2025, 1, 1), 1),
+    ]
+    get_opencodelists_codelist_create_events.save(store_path, records)
+
+    get_opencodelists_codelist_create_events.export(store_path, path)
+
+    assert sorted(p.parent.name for p in path.rglob("*.parquet")) == [
+        "month=2025-01",
+        "month=2025-02",
+    ]
+    assert io.read(Record, path) == sorted(records)
@@ -1,8 +1,14 @@
 import collections
+import concurrent.futures
 import datetime
+import os
 
-from tasks import utils
+import duckdb
+import pytest
+
+from tasks import io, utils
 from tasks.tasks import get_opencodelists_login_events
+from tasks.tasks.get_opencodelists_login_events import Login, Record, User
 
 
 Row = collections.namedtuple("Row", ["last_login", "email"])
@@ -17,3 +23,174 @@ def test_get_records():
     record = records[0]
     assert record.logged_in_at == datetime.datetime(2025, 1, 1, microsecond=0)
     assert record.email_hash == utils.sha256("user@example.com")
+
+
+@pytest.mark.parametrize(
+    "cpu_count,num_rows,is_pool",
+    [
+        (1, get_opencodelists_login_events.MIN_ROWS_FOR_PROCESSES, False),
+        (None, get_opencodelists_login_events.MIN_ROWS_FOR_PROCESSES, False),
+        (2, get_opencodelists_login_events.MIN_ROWS_FOR_PROCESSES - 1, False),
+        (2, get_opencodelists_login_events.MIN_ROWS_FOR_PROCESSES, True),
+    ],
+)
+def test_get_executor(monkeypatch, cpu_count, num_rows, is_pool):
+    monkeypatch.setattr(os, "cpu_count", lambda: cpu_count)
+    # A pool doesn't start its processes until it is given a task
+    with get_opencodelists_login_events.get_executor(num_rows) as executor:
+        assert isinstance(executor, concurrent.futures.ProcessPoolExecutor) is is_pool
+
+
+def test_get_watermark(tmp_path):
+    history_path = tmp_path / "login_events.duckdb"
+    assert get_opencodelists_login_events.get_watermark(history_path) is None
+
+    get_opencodelists_login_events.save(
+        history_path,
+        [
+            Record(datetime.datetime(2025, 1, 2), "hash_a"),
+            Record(datetime.datetime(2025, 1, 1), "hash_b"),
+        ],
+    )
+    watermark = get_opencodelists_login_events.get_watermark(history_path)
+    assert watermark == datetime.datetime(2025, 1, 2)
+
+
+def test_get_watermark_of_empty_history(tmp_path):
+    history_path = tmp_path / "login_events.duckdb"
+    get_opencodelists_login_events.save(
+        history_path, [Record(datetime.datetime(2025, 1, 1), "hash_a")]
+    )
+    with duckdb.connect(str(history_path)) as conn:
+        conn.execute("DELETE FROM login_events")
+
+    assert get_opencodelists_login_events.get_watermark(history_path) is None
+
+
+def test_save_adds_changed_logins(tmp_path):
+    history_path = tmp_path / "login_events.duckdb"
+    get_opencodelists_login_events.save(
+        history_path,
+        [
+            Record(datetime.datetime(2025, 1, 1), "hash_a"),
+            Record(datetime.datetime(2025, 1, 1), "hash_b"),
+        ],
+    )
+
+    num_added = get_opencodelists_login_events.save(
+        history_path,
+        [
+            Record(datetime.datetime(2025, 1, 1), "hash_b"),  # repeat
+            Record(datetime.datetime(2025, 1, 2), "hash_a"),  # logged in again
+            Record(datetime.datetime(2025, 1, 2), "hash_c"),  # new user
+        ],
+    )
+
+    assert num_added == 2
+    assert io.read(Record, history_path, order_by="logged_in_at, email_hash") == [
+        Record(datetime.datetime(2025, 1, 1), "hash_a"),
+        Record(datetime.datetime(2025, 1, 1), "hash_b"),
+        Record(datetime.datetime(2025, 1, 2), "hash_a"),
+        Record(datetime.datetime(2025, 1, 2), "hash_c"),
+    ]
+
+
+def test_seed(tmp_path):
+    history_path = tmp_path / "login_events.duckdb"
+    path = tmp_path / "login_events.parquet"
+    assert get_opencodelists_login_events.seed(history_path, path) == 0
+    assert not history_path.exists()
+
+    record = Record(datetime.datetime(2025, 1, 1), "hash_a")
+    io.write([record], path, partition_by="logged_in_at")
+    assert get_opencodelists_login_events.seed(history_path, path) == 1
+    assert io.read(Record, history_path) == [record]
+
+    # A history is only seeded once
+    assert get_opencodelists_login_events.seed(history_path, path) == 0
+
+
+def test_seed_from_export(tmp_path):
+    history_path = tmp_path / "login_events.duckdb"
+    path = tmp_path / "login_events.parquet"
+    io.write(
+        [Login(datetime.datetime(2025, 1, 1), 1)], path, partition_by="logged_in_at"
+    )
+
+    assert get_opencodelists_login_events.seed(history_path, path) == 0
+    assert not history_path.exists()
+
+
+def test_export_keeps_user_ids(tmp_path):
+    history_path = tmp_path / "login_events.duckdb"
+    users_path = tmp_path / "users.duckdb"
+    path = tmp_path / "login_events.parquet"
+    get_opencodelists_login_events.save(
+        history_path,
+        [
+            Record(datetime.datetime(2025, 1, 1), "hash_a"),
+            Record(datetime.datetime(2025, 1, 2), "hash_b"),
+        ],
+    )
+    get_opencodelists_login_events.export(history_path, users_path, path)
+
+    # A user's ID doesn't change, and a new user is given the next ID
+    get_opencodelists_login_events.save(
+        history_path,
+        [
+            Record(datetime.datetime(2025, 1, 3), "hash_b"),
+            Record(datetime.datetime(2025, 1, 3), "hash_c"),
+        ],
+    )
+    get_opencodelists_login_events.export(history_path, users_path, path)
+
+    assert sorted(io.read(User, users_path)) == [
+        User("hash_a", 1),
+        User("hash_b", 2),
+        User("hash_c", 3),
+    ]
+    assert sorted(io.read(Login, path)) == [
+        Login(datetime.datetime(2025, 1, 1), 1),
+        Login(datetime.datetime(2025, 1, 2), 2),
+        Login(datetime.datetime(2025, 1, 3), 2),
+        Login(datetime.datetime(2025, 1, 3), 3),
+    ]
+
+
+def test_export(tmp_path):
+    history_path = tmp_path / "login_events.duckdb"
+    users_path = tmp_path / "users.duckdb"
+    path = tmp_path / "login_events.parquet"
+    get_opencodelists_login_events.save(
+        history_path,
+        [
+            Record(datetime.datetime(2025, 2, 1), "hash_a"),
+            Record(datetime.datetime(2025, 1, 1), "hash_b"),
+            Record(datetime.datetime(2025, 1, 2), "hash_a"),
+        ],
+    )
+
+    get_opencodelists_login_events.export(history_path, users_path, path)
+
+    assert sorted(p.parent.name for p in path.rglob("*.parquet")) == [
+        "month=2025-01",
+        "month=2025-02",
+    ]
+    # Users are given IDs in the order of their first logins
+    assert sorted(io.read(Login, path)) == [
+        Login(datetime.datetime(2025, 1, 1), 1),
+        Login(datetime.datetime(2025, 1, 2), 2),
+        Login(datetime.datetime(2025, 2, 1), 2),
+    ]
+
+
+def test_get_records_in_batches(monkeypatch):
+    monkeypatch.setattr(get_opencodelists_login_events, "BATCH_SIZE", 2)
+    rows = [
+        Row(last_login=datetime.datetime(2025, 1, 1), email=f"user{i}@example.com")
+        for i in range(3)
+    ]
+    records = list(get_opencodelists_login_events.get_records(rows))
+    assert [record.email_hash for record in records] == [
+        utils.sha256(f"user{i}@example.com") for i in range(3)
+    ]
@@ -0,0 +1,47 @@
+import datetime
+
+from tasks import io
+from tasks.tasks import get_opencodelists_rollups
+from tasks.tasks.get_opencodelists_codelist_create_events import (
+    Record as CodelistCreateEvent,
+)
+from tasks.tasks.get_opencodelists_login_events import Login
+from tasks.tasks.get_opencodelists_rollups import (
+    CodelistCreateEventsPerDay,
+    LoginEventsPerDay,
+)
+
+
+def test_get_login_events_per_day(tmp_path):
+    path = tmp_path / "login_events.parquet"
+    io.write(
+        [
+            Login(datetime.datetime(2025, 1, 1, 9), 1),
+            Login(datetime.datetime(2025, 1, 1, 17), 1),
+            Login(datetime.datetime(2025, 1, 1, 23, 59, 59), 2),
+            Login(datetime.datetime(2025, 1, 3), 1),
+        ],
+        path,
+        partition_by="logged_in_at",
+    )
+    assert get_opencodelists_rollups.get_login_events_per_day(path) == [
+        LoginEventsPerDay(datetime.date(2025, 1, 1), 3, 2),
+        LoginEventsPerDay(datetime.date(2025, 1, 3), 1, 1),
+    ]
+
+
+def test_get_codelist_create_events_per_day(tmp_path):
+    path = tmp_path / "codelist_create_events.parquet"
+    io.write(
+        [
+            CodelistCreateEvent(datetime.datetime(2025, 1, 2), 1),
+            CodelistCreateEvent(datetime.datetime(2025, 1, 1), 2),
+            CodelistCreateEvent(datetime.datetime(2025, 1, 2, 12), 3),
+        ],
+        path,
+        partition_by="created_at",
+    )
+    assert get_opencodelists_rollups.get_codelist_create_events_per_day(path) == [
+        CodelistCreateEventsPerDay(datetime.date(2025, 1, 1), 1),
+        CodelistCreateEventsPerDay(datetime.date(2025, 1, 2), 2),
+    ]
@@ -1,3 +1,5 @@
+import pathlib
+
 import pytest
 import sqlalchemy
 
@@ -15,6 +17,22 @@ def test_get_engine_with_unknown_database():
         db.get_engine("foo")
 
 
+def test_get_paths(monkeypatch):
+    monkeypatch.setenv("OPENCODELISTS_DATABASE_PATH", "opencodelists.sqlite3")
+    paths = db.get_paths(db.Database.OPENCODELISTS)
+    assert paths == [pathlib.Path("opencodelists.sqlite3")]
+
+
+def test_get_paths_without_environment_variable(monkeypatch):
+    monkeypatch.delenv("OPENCODELISTS_DATABASE_PATH", raising=False)
+    assert db.get_paths(db.Database.OPENCODELISTS) == []
+
+
+def test_get_paths_with_unknown_database():
+    with pytest.raises(TypeError, match="Cannot get paths for database `foo`"):
+        db.get_paths("foo")
+
+
 def test_reflect_metadata():
     engine = sqlalchemy.create_engine("sqlite+pysqlite:///:memory:")
     with engine.connect() as conn:
@@ -26,3 +44,31 @@ def test_reflect_metadata():
 
     metadata = db.reflect_metadata(engine)
     assert "my_table" in metadata.tables
+
+
+def test_reflect_metadata_only():
+    engine = sqlalchemy.create_engine("sqlite+pysqlite:///:memory:")
+    metadata = sqlalchemy.MetaData()
+    for table_name in ["my_table", "other_table"]:
+        sqlalchemy.Table(
+            table_name, metadata, sqlalchemy.Column("my_column", sqlalchemy.String)
+        )
+    metadata.create_all(engine)
+
+    metadata = db.reflect_metadata(engine, only=["my_table"])
+    assert list(metadata.tables) == ["my_table"]
+
+
+def test_stream(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite+pysqlite:///{tmp_path / 'db.sqlite3'}")
+    table = sqlalchemy.Table(
+        "my_table",
+        sqlalchemy.MetaData(),
+        sqlalchemy.Column("my_column", sqlalchemy.Integer),
+    )
+    with engine.begin() as conn:
+        table.create(conn)
+        conn.execute(table.insert(), [{"my_column": i} for i in range(5)])
+
+    rows = db.stream(engine, sqlalchemy.select(table.c.my_column), batch_size=2)
+    assert [row.my_column for row in rows] == [0, 1, 2, 3, 4]
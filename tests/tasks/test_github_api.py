@@ -0,0 +1,99 @@
+import pytest
+import requests
+
+from tasks import github_api
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def rate_limit(cost=1, remaining=5000, reset_at="1970-01-01T01:00:00Z"):
+    return {"cost": cost, "remaining": remaining, "resetAt": reset_at}
+
+
+def test_rate_limiter_does_not_wait_before_first_query():
+    clock = FakeClock()
+    rate_limiter = github_api.RateLimiter(clock.time, clock.sleep)
+    assert rate_limiter.acquire("token") == 1
+    assert clock.sleeps == []
+
+
+def test_rate_limiter_waits_until_reset_when_budget_is_spent():
+    clock = FakeClock()
+    rate_limiter = github_api.RateLimiter(clock.time, clock.sleep)
+    cost = rate_limiter.acquire("token")
+    rate_limiter.release("token", cost, rate_limit(remaining=0))
+
+    rate_limiter.acquire("token")
+
+    assert clock.sleeps == [3600]
+
+
+def test_rate_limiter_counts_queries_in_flight():
+    clock = FakeClock()
+    rate_limiter = github_api.RateLimiter(clock.time, clock.sleep)
+    cost = rate_limiter.acquire("token")
+    rate_limiter.release("token", cost, rate_limit(cost=2, remaining=3))
+
+    rate_limiter.acquire("token")  # reserves 2 of the remaining 3 points
+    rate_limiter.acquire("other-token")  # has its own budget
+    assert clock.sleeps == []
+
+    rate_limiter.acquire("token")  # the remaining point doesn't cover the cost
+    assert clock.sleeps == [3600]
+
+
+def test_rate_limiter_release_after_failed_query():
+    clock = FakeClock()
+    rate_limiter = github_api.RateLimiter(clock.time, clock.sleep)
+    cost = rate_limiter.acquire("token")
+    rate_limiter.release("token", cost, None)
+    assert rate_limiter.acquire("token") == 1
+
+
+@pytest.mark.parametrize(
+    "status_code,headers,expected",
+    [
+        (502, {}, True),
+        (403, {"Retry-After": "60"}, True),
+        (429, {"X-RateLimit-Remaining": "0"}, True),
+        (403, {"X-RateLimit-Remaining": "10"}, False),
+        (401, {}, False),
+    ],
+)
+def test_is_retryable(status_code, headers, expected):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    assert github_api.is_retryable(response) == expected
+
+
+def test_is_rate_limited():
+    assert github_api.is_rate_limited({"errors": [{"type": "RATE_LIMITED"}]})
+    assert not github_api.is_rate_limited({"errors": [{"type": "NOT_FOUND"}]})
+    assert not github_api.is_rate_limited({"data": {}})
+
+
+@pytest.mark.parametrize(
+    "headers,attempt,expected",
+    [
+        ({"Retry-After": "30"}, 0, 30),
+        ({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1100"}, 0, 100),
+        ({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "900"}, 0, 0),
+        ({}, 0, 1),
+        ({}, 3, 8),
+        ({}, 10, 60),
+    ],
+)
+def test_get_retry_delay(headers, attempt, expected):
+    assert github_api.get_retry_delay(headers, attempt, now=1000) == expected
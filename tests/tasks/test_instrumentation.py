@@ -0,0 +1,89 @@
+import collections
+import json
+
+import duckdb
+import pytest
+
+from tasks import instrumentation, io
+
+
+@pytest.fixture
+def report_path(tmp_path, monkeypatch):
+    report_path = tmp_path / "report.jsonl"
+    monkeypatch.setenv(instrumentation.REPORT_PATH_ENV_VAR, str(report_path))
+    return report_path
+
+
+def read_report(report_path):
+    return [json.loads(line) for line in report_path.read_text().splitlines()]
+
+
+def test_span(report_path):
+    with instrumentation.span("my_span", path=report_path) as span:
+        span["rows"] = 2
+
+    (record,) = read_report(report_path)
+    assert record["type"] == "span"
+    assert record["name"] == "my_span"
+    assert record["status"] == "ok"
+    assert record["path"] == str(report_path)
+    assert record["rows"] == 2
+    assert record["duration"] >= 0
+    assert record["peak_rss"] > 0
+
+
+def test_span_with_error(report_path):
+    with pytest.raises(ValueError):
+        with instrumentation.span("my_span"):
+            raise ValueError
+
+    (record,) = read_report(report_path)
+    assert record["status"] == "error"
+
+
+def test_span_as_decorator(report_path):
+    @instrumentation.span("my_function")
+    def my_function():
+        pass
+
+    my_function()
+    my_function()
+
+    assert [record["name"] for record in read_report(report_path)] == [
+        "my_function",
+        "my_function",
+    ]
+
+
+def test_record_without_report(tmp_path, monkeypatch):
+    monkeypatch.delenv(instrumentation.REPORT_PATH_ENV_VAR, raising=False)
+    monkeypatch.chdir(tmp_path)
+    instrumentation.record("my_record")
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_write_records_rows(tmp_path, report_path, suffix):
+    Record = collections.namedtuple("Record", ["name"])
+    f_path = tmp_path / f"records{suffix}"
+
+    io.write([Record("name_a"), Record("name_b")], f_path)
+
+    (record,) = read_report(report_path)
+    assert record["name"] == "io.write"
+    assert record["path"] == str(f_path)
+    assert record["rows"] == 2
+
+
+@pytest.mark.parametrize("partition_by", [None, "created_at"])
+def test_write_relation_rows(tmp_path, report_path, partition_by):
+    f_path = tmp_path / "records.parquet"
+    with duckdb.connect() as conn:
+        rel = conn.sql(
+            "SELECT TIMESTAMP '2025-01-01' + to_days(CAST(range AS INTEGER)) AS created_at "
+            + "FROM range(40)"
+        )
+        io.write(rel, f_path, partition_by=partition_by)
+
+    (record,) = read_report(report_path)
+    assert record["rows"] == 40
@@ -1,5 +1,8 @@
 import collections
+import datetime
+import pathlib
 
+import duckdb
 import pytest
 
 from tasks import io
@@ -16,6 +19,115 @@ def test_round_trip_csv(tmp_path):
     assert io.read(Record, f_path) == records
 
 
+def test_round_trip_parquet(tmp_path):
+    Record = collections.namedtuple("Record", ["number", "created_at", "is_draft"])
+    f_path = tmp_path / "subdir" / "records.parquet"
+    records = [
+        Record(1, datetime.datetime(2025, 1, 1), True),
+        Record(2, datetime.datetime(2025, 1, 2), False),
+    ]
+
+    io.write(records, f_path)
+
+    assert io.read(Record, f_path) == records
+
+
+def test_write_parquet_with_schema(tmp_path):
+    Record = collections.namedtuple("Record", ["number", "created_at", "closed_at"])
+    f_path = tmp_path / "records.parquet"
+    records = [Record("1", "2025-01-01T00:00:00Z", "")]
+    schema = {"number": "INTEGER", "created_at": "TIMESTAMP", "closed_at": "TIMESTAMP"}
+
+    io.write(records, f_path, schema=schema)
+
+    assert io.read(Record, f_path) == [Record(1, datetime.datetime(2025, 1, 1), None)]
+
+
+def test_round_trip_partitioned_parquet(tmp_path):
+    Record = collections.namedtuple("Record", ["created_at", "id"])
+    f_path = tmp_path / "records.parquet"
+    records = [
+        Record(datetime.datetime(2025, 1, 31, 23, 59, 59), 1),
+        Record(datetime.datetime(2025, 2, 1), 2),
+    ]
+
+    io.write(records, f_path, partition_by="created_at")
+
+    assert sorted(p.relative_to(f_path) for p in f_path.glob("*/*.parquet")) == [
+        pathlib.Path("month=2025-01", "data_0.parquet"),
+        pathlib.Path("month=2025-02", "data_0.parquet"),
+    ]
+    assert io.read(Record, f_path) == records
+
+
+def test_write_partitioned_parquet_replaces_records(tmp_path):
+    Record = collections.namedtuple("Record", ["created_at", "id"])
+    f_path = tmp_path / "records.parquet"
+    io.write([Record(datetime.datetime(2025, 1, 1), 1)], f_path)  # not partitioned
+    io.write(
+        [Record(datetime.datetime(2025, 2, 1), 2)], f_path, partition_by="created_at"
+    )
+
+    records = [Record(datetime.datetime(2025, 3, 1), 3)]
+    io.write(records, f_path, partition_by="created_at")
+
+    assert [p.name for p in f_path.iterdir()] == ["month=2025-03"]
+    assert io.read(Record, f_path) == records
+
+
+def test_write_partitioned_parquet_keeps_records_if_write_fails(tmp_path):
+    Record = collections.namedtuple("Record", ["created_at", "id"])
+    f_path = tmp_path / "records.parquet"
+    schema = {"created_at": "TIMESTAMP", "id": "INTEGER"}
+    records = [Record(datetime.datetime(2025, 1, 1), 1)]
+    io.write(records, f_path, schema=schema, partition_by="created_at")
+
+    with pytest.raises(duckdb.ConversionException):
+        io.write(
+            [Record("2025-02-01", "not an integer")],
+            f_path,
+            schema=schema,
+            partition_by="created_at",
+        )
+
+    assert [p.name for p in tmp_path.iterdir()] == ["records.parquet"]
+    assert io.read(Record, f_path) == records
+
+
+def test_write_partitioned_csv(tmp_path):
+    Record = collections.namedtuple("Record", ["created_at"])
+    with pytest.raises(ValueError, match="only supported for Parquet"):
+        io.write(
+            [Record("2025-01-01")], tmp_path / "records.csv", partition_by="created_at"
+        )
+
+
+def test_write_relation(tmp_path):
+    Record = collections.namedtuple("Record", ["created_at", "id"])
+    f_path = tmp_path / "records.parquet"
+    with duckdb.connect() as conn:
+        rel = conn.sql(
+            "SELECT TIMESTAMP '2025-01-01' + to_days(CAST(range AS INTEGER)) AS created_at, "
+            + "CAST(range AS INTEGER) AS id FROM range(2)"
+        )
+        io.write(rel, f_path, partition_by="created_at")
+
+        with pytest.raises(ValueError, match="only supported for Parquet"):
+            io.write(rel, tmp_path / "records.csv")
+
+    assert io.read(Record, f_path) == [
+        Record(datetime.datetime(2025, 1, 1), 0),
+        Record(datetime.datetime(2025, 1, 2), 1),
+    ]
+
+
+def test_get_parquet_glob(tmp_path):
+    f_path = tmp_path / "records.parquet"
+    assert io.get_parquet_glob(f_path) == str(f_path)
+    f_path.mkdir()
+    assert io.get_parquet_glob(f_path) == str(f_path / "*" / "*.parquet")
+
+
 def test_write_unsupported_file_type(tmp_path):
     f_path = tmp_path / "subdir" / "obj.json"
     with pytest.raises(ValueError):
@@ -29,8 +141,9 @@ def test_read_unsupported_file_type(tmp_path):
         io.read(None, f_path)
 
 
-def test_read_wrong_record_format(tmp_path):
-    f_path = tmp_path / "records.csv"
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_read_wrong_record_format(tmp_path, suffix):
+    f_path = tmp_path / f"records{suffix}"
 
     OldRecord = collections.namedtuple("Record", ["name"])
     records = [OldRecord("name_a"), OldRecord("name_b")]
@@ -39,3 +152,174 @@ def test_read_wrong_record_format(tmp_path):
     NewRecord = collections.namedtuple("Record", ["other_field"])
     with pytest.raises(ValueError):
         io.read(NewRecord, f_path)
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_iter_records(tmp_path, suffix):
+    Record = collections.namedtuple("Record", ["name"])
+    f_path = tmp_path / f"records{suffix}"
+    records = [Record("name_a"), Record("name_b")]
+    io.write(records, f_path)
+
+    records_iter = io.iter_records(Record, f_path)
+
+    assert not isinstance(records_iter, list)
+    assert list(records_iter) == records
+
+
+def test_iter_records_checks_fields_before_reading(tmp_path):
+    f_path = tmp_path / "records.csv"
+    io.write([collections.namedtuple("Record", ["name"])("name_a")], f_path)
+
+    NewRecord = collections.namedtuple("Record", ["other_field"])
+    with pytest.raises(ValueError):
+        io.iter_records(NewRecord, f_path)
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_iter_batches(tmp_path, suffix):
+    Record = collections.namedtuple("Record", ["name", "value"])
+    f_path = tmp_path / f"records{suffix}"
+    io.write([Record("a", "1"), Record("b", "2"), Record("c", "3")], f_path)
+
+    batches = list(io.iter_batches(Record, f_path, batch_size=2))
+
+    assert [batch.name for batch in batches] == [["a", "b"], ["c"]]
+
+
+STORE_SCHEMA = {"name": "VARCHAR", "value": "INTEGER", "updated_at": "TIMESTAMP"}
+
+
+def test_upsert(tmp_path):
+    Record = collections.namedtuple("Record", ["name", "value", "updated_at"])
+    f_path = tmp_path / "subdir" / "records.duckdb"
+
+    num_changes = io.upsert(
+        [Record("a", "1", "2025-01-02T00:00:00Z"), Record("b", "", "2025-01-01")],
+        f_path,
+        STORE_SCHEMA,
+        ["name"],
+        index=["updated_at"],
+    )
+    assert num_changes == 2
+
+    # Record a is unchanged, record b is changed, and record c is new
+    num_changes = io.upsert(
+        [
+            Record("a", "1", "2025-01-02T00:00:00Z"),
+            Record("b", "2", "2025-01-03T00:00:00Z"),
+            Record("c", "3", "2025-01-04T00:00:00Z"),
+        ],
+        f_path,
+        STORE_SCHEMA,
+        ["name"],
+        index=["updated_at"],
+    )
+    assert num_changes == 2
+
+    assert io.read(Record, f_path, order_by="updated_at") == [
+        Record("a", 1, datetime.datetime(2025, 1, 2)),
+        Record("b", 2, datetime.datetime(2025, 1, 3)),
+        Record("c", 3, datetime.datetime(2025, 1, 4)),
+    ]
+    assert io.read_last(Record, f_path, "updated_at") == Record(
+        "c", 3, datetime.datetime(2025, 1, 4)
+    )
+
+
+def test_upsert_with_same_key(tmp_path):
+    Record = collections.namedtuple("Record", ["name", "value", "updated_at"])
+    f_path = tmp_path / "records.duckdb"
+    io.upsert([Record("a", "1", "2025-01-01")], f_path, STORE_SCHEMA, ["name"])
+
+    # The last record with a key wins, whether or not the key is in the store
+    num_changes = io.upsert(
+        [
+            Record("a", "2", "2025-01-02"),
+            Record("b", "1", "2025-01-01"),
+            Record("a", "3", "2025-01-03"),
+            Record("b", "2", "2025-01-02"),
+        ],
+        f_path,
+        STORE_SCHEMA,
+        ["name"],
+    )
+
+    assert num_changes == 2
+    assert io.read(Record, f_path, order_by="name") == [
+        Record("a", 3, datetime.datetime(2025, 1, 3)),
+        Record("b", 2, datetime.datetime(2025, 1, 2)),
+    ]
+
+
+def test_upsert_without_records(tmp_path):
+    f_path = tmp_path / "records.duckdb"
+    assert io.upsert([], f_path, STORE_SCHEMA, ["name"]) == 0
+    assert not f_path.exists()
+
+
+def test_upsert_is_transactional(tmp_path):
+    Record = collections.namedtuple("Record", ["name", "value", "updated_at"])
+    f_path = tmp_path / "records.duckdb"
+    io.upsert([Record("a", "1", "2025-01-01")], f_path, STORE_SCHEMA, ["name"])
+
+    # The second record can't be cast to the schema, so neither record is inserted
+    with pytest.raises(duckdb.ConversionException):
+        io.upsert(
+            [Record("b", "2", "2025-01-02"), Record("c", "not a number", "")],
+            f_path,
+            STORE_SCHEMA,
+            ["name"],
+        )
+
+    assert [record.name for record in io.read(Record, f_path)] == ["a"]
+
+
+def test_upsert_with_only_key_fields(tmp_path):
+    Record = collections.namedtuple("Record", ["name"])
+    f_path = tmp_path / "records.duckdb"
+    io.upsert([Record("a")], f_path, {"name": "VARCHAR"}, ["name"])
+
+    num_changes = io.upsert(
+        [Record("a"), Record("b")], f_path, {"name": "VARCHAR"}, ["name"]
+    )
+
+    assert num_changes == 1
+
+
+def test_upsert_unsupported_file_type(tmp_path):
+    with pytest.raises(ValueError):
+        io.upsert([], tmp_path / "records.parquet", STORE_SCHEMA, ["name"])
+
+
+def test_count(tmp_path):
+    Record = collections.namedtuple("Record", ["name", "value", "updated_at"])
+    f_path = tmp_path / "records.duckdb"
+    io.upsert(
+        [
+            Record("a", "1", "2025-01-01T00:00:00Z"),
+            Record("b", "2", "2025-01-01T00:00:00Z"),
+            Record("c", "3", "2025-01-02T00:00:00Z"),
+        ],
+        f_path,
+        STORE_SCHEMA,
+        ["name"],
+        index=["updated_at"],
+    )
+
+    assert io.count(f_path, "updated_at", "2025-01-01T00:00:00Z") == 2
+
+
+def test_read_last_from_empty_store(tmp_path):
+    Record = collections.namedtuple("Record", ["name"])
+    f_path = tmp_path / "records.duckdb"
+    io.upsert([Record("a")], f_path, {"name": "VARCHAR"}, ["name"])
+    with duckdb.connect(str(f_path)) as conn:
+        conn.execute("DELETE FROM records")
+
+    assert io.read_last(Record, f_path, "name") is None
+
+
+def test_read_with_order_by_unsupported_file_type(tmp_path):
+    with pytest.raises(ValueError, match="only supported for stores"):
+        io.read(None, tmp_path / "records.csv", order_by="name")
@@ -0,0 +1,170 @@
+import concurrent.futures
+
+import pytest
+
+from tasks import runner
+from tasks.runner import Status, Task
+from tasks.tasks import get_opencodelists_rollups
+
+
+class FakeTasks:
+    """Run tasks by writing their outputs, recording the order in which they ran."""
+
+    def __init__(self, tasks, failing=()):
+        self.tasks = {task.name: task for task in tasks}
+        self.failing = failing
+        self.names_run = []
+
+    def run_task(self, name):
+        self.names_run.append(name)
+        if name in self.failing:
+            raise ValueError(name)
+        for output in self.tasks[name].outputs:
+            output.write_text(name)
+
+
+def run(tasks, state_path, **kwargs):
+    fake_tasks = FakeTasks(tasks, kwargs.pop("failing", ()))
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        statuses = runner.run(
+            tasks, executor, state_path, run_task=fake_tasks.run_task, **kwargs
+        )
+    return statuses, fake_tasks.names_run
+
+
+def test_run_in_order(tmp_path):
+    a = Task("a", [], [tmp_path / "a.txt"])
+    b = Task("b", [tmp_path / "a.txt"], [tmp_path / "b.txt"])
+    c = Task("c", [tmp_path / "b.txt"], [tmp_path / "c.txt"])
+
+    statuses, names_run = run([c, b, a], tmp_path / "state.json")
+
+    assert statuses == {
+        "a": Status.SUCCEEDED,
+        "b": Status.SUCCEEDED,
+        "c": Status.SUCCEEDED,
+    }
+    assert names_run == ["a", "b", "c"]
+
+
+def test_run_skips_up_to_date_tasks(tmp_path):
+    (tmp_path / "input.txt").write_text("input")
+    b = Task("b", [tmp_path / "input.txt"], [tmp_path / "b.txt"])
+    c = Task("c", [tmp_path / "b.txt"], [tmp_path / "c.txt"])
+    state_path = tmp_path / "state.json"
+
+    run([b, c], state_path)
+    statuses, names_run = run([b, c], state_path)
+
+    assert statuses == {"b": Status.SKIPPED, "c": Status.SKIPPED}
+    assert names_run == []
+
+
+def test_run_reruns_tasks_with_changed_inputs(tmp_path):
+    (tmp_path / "input.txt").write_text("input")
+    b = Task("b", [tmp_path / "input.txt"], [tmp_path / "b.txt"])
+    c = Task("c", [tmp_path / "b.txt"], [tmp_path / "c.txt"])
+    state_path = tmp_path / "state.json"
+
+    run([b, c], state_path)
+    (tmp_path / "input.txt").write_text("changed input")
+    statuses, names_run = run([b, c], state_path)
+
+    assert statuses == {"b": Status.SUCCEEDED, "c": Status.SUCCEEDED}
+    assert names_run == ["b", "c"]
+
+
+def test_run_reruns_tasks_with_missing_outputs(tmp_path):
+    (tmp_path / "input.txt").write_text("input")
+    b = Task("b", [tmp_path / "input.txt"], [tmp_path / "b.txt"])
+    state_path = tmp_path / "state.json"
+
+    run([b], state_path)
+    (tmp_path / "b.txt").unlink()
+    statuses, _ = run([b], state_path)
+
+    assert statuses == {"b": Status.SUCCEEDED}
+
+
+def test_run_with_force(tmp_path):
+    (tmp_path / "input.txt").write_text("input")
+    b = Task("b", [tmp_path / "input.txt"], [tmp_path / "b.txt"])
+    state_path = tmp_path / "state.json"
+
+    run([b], state_path)
+    statuses, _ = run([b], state_path, force=True)
+
+    assert statuses == {"b": Status.SUCCEEDED}
+
+
+def test_run_with_failing_task(tmp_path):
+    a = Task("a", [], [tmp_path / "a.txt"])
+    b = Task("b", [tmp_path / "a.txt"], [tmp_path / "b.txt"])
+    c = Task("c", [tmp_path / "b.txt"], [tmp_path / "c.txt"])
+    d = Task("d", [], [tmp_path / "d.txt"])
+
+    statuses, names_run = run([a, b, c, d], tmp_path / "state.json", failing={"a"})
+
+    assert statuses == {
+        "a": Status.FAILED,
+        "b": Status.NOT_RUN,
+        "c": Status.NOT_RUN,
+        "d": Status.SUCCEEDED,
+    }
+    assert sorted(names_run) == ["a", "d"]
+
+
+def test_run_with_cycle(tmp_path):
+    a = Task("a", [tmp_path / "b.txt"], [tmp_path / "a.txt"])
+    b = Task("b", [tmp_path / "a.txt"], [tmp_path / "b.txt"])
+    with pytest.raises(ValueError, match="depend on each other"):
+        run([a, b], tmp_path / "state.json")
+
+
+def test_get_dependencies(tmp_path):
+    a = Task("a", [], [tmp_path / "a"])  # a directory
+    b = Task("b", [tmp_path / "a" / "b.txt"], [tmp_path / "b.txt"])
+    c = Task("c", [tmp_path], [tmp_path / "c.txt"])
+    assert runner.get_dependencies([a, b, c]) == {
+        "a": set(),
+        "b": {"a"},
+        "c": {"a", "b"},
+    }
+
+
+def test_get_fingerprint(tmp_path):
+    (tmp_path / "dir" / "subdir").mkdir(parents=True)
+    (tmp_path / "dir" / "subdir" / "file.txt").write_text("file")
+    fingerprint = runner.get_fingerprint([tmp_path / "dir", tmp_path / "missing.txt"])
+    assert [[path, size] for path, size, _ in fingerprint] == [
+        [str(tmp_path / "dir" / "subdir" / "file.txt"), 4],
+        [str(tmp_path / "missing.txt"), None],
+    ]
+
+
+def test_get_task():
+    task = runner.get_task("get_opencodelists_rollups")
+    assert task == Task(
+        "get_opencodelists_rollups",
+        get_opencodelists_rollups.INPUTS,
+        get_opencodelists_rollups.OUTPUTS,
+    )
+
+
+def test_run_task(monkeypatch):
+    names_run = []
+    monkeypatch.setattr(
+        get_opencodelists_rollups, "main", lambda: names_run.append("rollups")
+    )
+    runner.run_task("get_opencodelists_rollups")
+    assert names_run == ["rollups"]
+
+
+def test_run_task_with_failing_task(monkeypatch, capsys):
+    def main():
+        raise ValueError("Something went wrong")
+
+    monkeypatch.setattr(get_opencodelists_rollups, "main", main)
+    with pytest.raises(ValueError):
+        runner.run_task("get_opencodelists_rollups")
+    assert "Something went wrong" in capsys.readouterr().err
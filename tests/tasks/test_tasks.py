@@ -14,3 +14,7 @@ def test_task_modules_have_required_attributes():
         assert len(inspect.signature(mod.main).parameters) == 0, (
             f"`{dotted_modname}.main` accepts parameters"
         )
+        for attr in ["INPUTS", "OUTPUTS"]:
+            assert hasattr(mod, attr), (
+                f"`{dotted_modname}` does not contain a `{attr}` attribute"
+            )
@@ -1,6 +1,21 @@
+import concurrent.futures
+
 from tasks import utils
 
 
 def test_sha256():
     hashed = utils.sha256("user@example.com")
     assert hashed == "b4c9a289323b21a01c3e940f150eb9b8c542587f1abfd8f0e1cc1ffc5e475514"
+
+
+def test_sha256_many():
+    texts = ["user@example.com", "other@example.com"]
+    assert utils.sha256_many(texts) == [utils.sha256(text) for text in texts]
+
+
+def test_sha256_many_with_executor():
+    texts = [f"user{i}@example.com" for i in range(10)]
+    # A ProcessPoolExecutor has the same interface, but is costly to start
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        hashed = utils.sha256_many(texts, executor, chunksize=3)
+    assert hashed == [utils.sha256(text) for text in texts]